@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from embedding_cache import CachedEmbeddings
+from ensemble import ensemble_retriever_from_docs
+from full_chain import aask_question, create_full_chain
+from history_store import SQLHistoryStore
+from local_loader import load_txt_files
+from metrics import REGISTRY
+from model_registry import get_embeddings, warm_up
+from semantic_cache import SemanticCache
+
+state = {"chain": None, "error": None}
+
+
+def build_chain():
+    huggingfacehub_api_token = os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+    model = get_embeddings("sentence-transformers/all-MiniLM-L6-v2", provider="huggingface-endpoint",
+                           huggingfacehub_api_token=huggingfacehub_api_token)
+    # Open the connection to the embedding endpoint before the first question needs it.
+    warm_up(embeddings=[model])
+    embeddings = CachedEmbeddings(model)
+    retriever = ensemble_retriever_from_docs(load_txt_files(), embeddings=embeddings)
+    return create_full_chain(retriever,
+                             huggingfacehub_api_token=huggingfacehub_api_token,
+                             history_store=SQLHistoryStore(),
+                             semantic_cache=SemanticCache(embeddings))
+
+
+async def load_chain():
+    try:
+        state["chain"] = await asyncio.to_thread(build_chain)
+        logging.info("Index loaded, ready to serve")
+    except Exception as exc:
+        logging.exception("Failed to build the chain")
+        state["error"] = str(exc)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Build the index in the background so health checks answer while it loads.
+    load_dotenv()
+    task = asyncio.create_task(load_chain())
+    yield
+    task.cancel()
+
+
+app = FastAPI(title="LangChain RAG", lifespan=lifespan)
+
+
+class ChatRequest(BaseModel):
+    question: str
+    session_id: Optional[str] = None
+    filter: Optional[dict] = None
+    """Metadata filter in Chroma `where` syntax, e.g. {"source": "data/meal_plan.txt"}."""
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    if state["chain"] is not None:
+        return {"status": "ready"}
+    if state["error"]:
+        return JSONResponse({"status": "failed", "error": state["error"]}, status_code=503)
+    return JSONResponse({"status": "loading"}, status_code=503)
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    chain = state["chain"]
+    if chain is None:
+        return JSONResponse({"error": "index is not loaded yet"}, status_code=503)
+    session_id = request.session_id or uuid.uuid4().hex
+
+    # Server-sent events: one "token" event per streamed chunk, then "end" (or "error").
+    async def events():
+        try:
+            async for token in aask_question(chain, request.question, session_id=session_id,
+                                                   filter=request.filter):
+                yield f"event: token\ndata: {json.dumps(getattr(token, 'content', token))}\n\n"
+            yield "event: end\ndata: {}\n\n"
+        except Exception as exc:
+            logging.exception("Chat request failed")
+            yield f"event: error\ndata: {json.dumps(str(exc))}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"X-Session-Id": session_id, "Cache-Control": "no-cache"})
+
+
+def main():
+    import uvicorn
+
+    # Each worker process opens the retriever once; they take turns syncing the shared store
+    # (see vector_store.collection_lock), so only the first to start writes to it.
+    uvicorn.run("api_server:app",
+                host=os.environ.get("HOST", "0.0.0.0"),
+                port=int(os.environ.get("PORT", "8000")),
+                workers=int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+
+if __name__ == "__main__":
+    # this is to quiet parallel tokenizers warning.
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -2,21 +2,29 @@ import os
 
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
-from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
 
 from dotenv import load_dotenv
 
+from model_registry import get_async_http_client, get_chat_model, get_http_client
+
 
 MISTRAL_ID = "mistralai/Mistral-7B-Instruct-v0.1"
 ZEPHYR_ID = "HuggingFaceH4/zephyr-7b-beta"
 
 
 def get_model(repo_id=ZEPHYR_ID, **kwargs):
+    # One client per configuration for the whole process, sharing a pooled HTTP connection.
+    return get_chat_model(repo_id, create_model, **kwargs)
+
+
+def create_model(repo_id=ZEPHYR_ID, **kwargs):
+    # Provider SDKs are slow to import, so only the one in use is loaded.
     if repo_id == "ChatGPT":
-        chat_model = ChatOpenAI(temperature=0, **kwargs)
+        from langchain_openai import ChatOpenAI
+        chat_model = ChatOpenAI(temperature=0, http_client=get_http_client(),
+                                http_async_client=get_async_http_client(), **kwargs)
     else:
+        from langchain_groq import ChatGroq
         groq_api_token = kwargs.get("GROQ_API_KEY")
         chat_model = ChatGroq(
             model=repo_id,
@@ -24,12 +32,15 @@ def get_model(repo_id=ZEPHYR_ID, **kwargs):
             max_tokens=None,
             timeout=None,
             max_retries=3,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client(),
         )
         # huggingfacehub_api_token = kwargs.get("HUGGINGFACEHUB_API_TOKEN", None)
         # if not huggingfacehub_api_token:
         #     huggingfacehub_api_token = os.environ.get("HUGGINGFACEHUB_API_TOKEN", None)
         # os.environ["HF_TOKEN"] = huggingfacehub_api_token
         #
+        # from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
         # llm = HuggingFaceEndpoint(
         #     repo_id=repo_id,
         #     task="text-generation",
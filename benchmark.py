@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+
+import vector_store
+from bm25_index import BM25Index, BM25IndexRetriever
+from embedding_cache import CachedEmbeddings, EmbeddingStore
+from embedding_scheduler import EmbeddingScheduler
+from ensemble import ensemble_retriever_from_docs
+from filter import create_retriever
+from full_chain import ask_question, create_full_chain
+from hybrid_retriever import HybridRetriever
+from local_loader import load_csv_files, load_txt_files
+from quantized_index import MODES
+from splitter import split_documents
+from vector_store import as_retriever, create_vector_db
+
+
+# Modules the Streamlit app, API server and CLI start from; each must import within the budget.
+ENTRY_MODULES = ("full_chain", "ensemble", "api_server")
+IMPORT_BUDGET_SECONDS = 3.0
+
+
+def measure_import(module):
+    # A fresh interpreter, so nothing is already imported; best of three to smooth out disk caching.
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    samples = []
+    for _ in range(3):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    return min(samples)
+
+
+def bench_imports(budget):
+    results = {}
+    for module in ENTRY_MODULES:
+        seconds = measure_import(module)
+        results[module] = {"seconds": round(seconds, 3), "budget": budget, "over_budget": seconds > budget}
+    return results
+
+
+def make_vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def write_corpus(data_dir, n_docs, words_per_doc, vocabulary, rng):
+    # Zipf-like word frequencies so BM25 sees a realistic mix of common and rare terms.
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    os.makedirs(data_dir, exist_ok=True)
+    for i in range(n_docs):
+        words = rng.choices(vocabulary, weights=weights, k=words_per_doc)
+        sentences = [" ".join(words[j:j + 12]).capitalize() + "." for j in range(0, len(words), 12)]
+        with open(os.path.join(data_dir, f"doc_{i:05d}.txt"), "w") as f:
+            f.write(" ".join(sentences))
+
+
+def write_table(path, n_rows, vocabulary, rng):
+    categories = rng.sample(vocabulary, 20)
+    with open(path, "w") as f:
+        f.write("Food,Measure,Grams,Calories,Category,Notes\n")
+        for i in range(n_rows):
+            f.write(f"{rng.choice(vocabulary)} {i},1 cup,{rng.randint(1, 999)},{rng.randint(0, 900)},"
+                    f"{rng.choice(categories)},{' '.join(rng.choices(vocabulary, k=8))}\n")
+
+
+def make_queries(n_queries, vocabulary, rng):
+    return [" ".join(rng.sample(vocabulary, rng.randint(2, 6))) for _ in range(n_queries)]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def rate(seconds, items):
+    return {"seconds": round(seconds, 4), "items": items,
+            "per_second": round(items / seconds, 2) if seconds else None}
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {"n": len(ms),
+            "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p90_ms": round(float(np.percentile(ms, 90)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "max_ms": round(float(ms.max()), 3)}
+
+
+def bench_retriever(retriever, queries, warmup=3, **kwargs):
+    for query in queries[:warmup]:
+        retriever.invoke(query, **kwargs)
+    samples = []
+    for query in queries:
+        _, seconds = timed(retriever.invoke, query, **kwargs)
+        samples.append(seconds)
+    return percentiles(samples)
+
+
+def bench_chain(chain, queries, turns_per_session=2):
+    latency, first_token = [], []
+    for i, query in enumerate(queries):
+        # Consecutive queries share a session so later turns go through the history path.
+        session_id = f"bench-{i // turns_per_session}"
+        start = time.perf_counter()
+        first = None
+        for _ in ask_question(chain, query, session_id=session_id):
+            if first is None:
+                first = time.perf_counter() - start
+        latency.append(time.perf_counter() - start)
+        first_token.append(first if first is not None else latency[-1])
+    return {"latency": percentiles(latency), "time_to_first_token": percentiles(first_token)}
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    # Everything the run writes (corpus, Chroma, BM25, embedding cache) stays in the temp dir.
+    vector_store.STORE_DIR = os.path.join(workdir, "store")
+    try:
+        vocabulary = make_vocabulary(args.vocabulary, rng)
+        data_dir = os.path.join(workdir, "data")
+        write_corpus(data_dir, args.docs, args.words_per_doc, vocabulary, rng)
+        queries = make_queries(args.queries, vocabulary, rng)
+
+        embeddings = CachedEmbeddings(EmbeddingScheduler(DeterministicFakeEmbedding(size=args.dimensions)),
+                                      store=EmbeddingStore(os.path.join(workdir, "embedding_cache.sqlite")))
+
+        results = {"config": vars(args),
+                   "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                   "cpus": os.cpu_count()},
+                   "ingestion": {}, "retrieval": {}}
+        ingestion = results["ingestion"]
+
+        docs, seconds = timed(load_txt_files, data_dir)
+        ingestion["load"] = rate(seconds, len(docs))
+        texts, seconds = timed(split_documents, docs)
+        ingestion["split"] = rate(seconds, len(texts))
+        if args.csv_rows:
+            table_dir = os.path.join(workdir, "tables")
+            os.makedirs(table_dir)
+            write_table(os.path.join(table_dir, "foods.csv"), args.csv_rows, vocabulary, rng)
+            rows, seconds = timed(load_csv_files, table_dir, metadata_columns=["Category"])
+            ingestion["load_csv"] = rate(seconds, len(rows))
+            _, seconds = timed(split_documents, rows)
+            ingestion["split_csv"] = rate(seconds, len(rows))
+        _, seconds = timed(embeddings.embed_documents, [t.page_content for t in texts])
+        ingestion["embed"] = rate(seconds, len(texts))
+
+        # Vectors are now cached, so this measures the Chroma and BM25 writes.
+        bm25_index = BM25Index(os.path.join(vector_store.store_path("bench"), "bm25"))
+        start = time.perf_counter()
+        vs = create_vector_db(texts, embeddings, collection_name="bench", indexes=[bm25_index])
+        bm25_index.save()
+        ingestion["write"] = rate(time.perf_counter() - start, len(texts))
+
+        # Same collection again: every chunk is already indexed, so this is the restart cost.
+        ensemble, seconds = timed(ensemble_retriever_from_docs, docs, embeddings, collection_name="bench")
+        ingestion["reindex_unchanged"] = rate(seconds, len(texts))
+
+        vector_retriever = as_retriever(vs, search_kwargs={"k": args.k})
+        bm25_retriever = BM25IndexRetriever(index=bm25_index, k=args.k)
+        retrievers = {
+            "vector": vector_retriever,
+            "bm25": bm25_retriever,
+            "hybrid": HybridRetriever(retrievers=[bm25_retriever, vector_retriever], weights=[0.5, 0.5]),
+            "ensemble": ensemble,
+            "filter": create_retriever(texts, dense_embeddings=embeddings, sparse_embeddings=embeddings),
+        }
+        results["quantization"] = {}
+        for mode in MODES:
+            quantized = create_vector_db(texts, embeddings, collection_name=f"bench_{mode}", quantization=mode)
+            retrievers[f"vector_{mode}"] = as_retriever(quantized, search_kwargs={"k": args.k})
+            results["quantization"][mode] = {"recall_at_k": quantized.recall(k=args.k),
+                                             "bytes_per_chunk": quantized.memory_bytes() / len(quantized),
+                                             "float32_bytes_per_chunk": quantized.dim * 4}
+        for name, retriever in retrievers.items():
+            results["retrieval"][name] = bench_retriever(retriever, queries)
+        # A scoped question: only a tenth of the sources may answer it.
+        sources = sorted({doc.metadata["source"] for doc in docs})
+        scope = {"source": {"$in": sources[:max(1, len(sources) // 10)]}}
+        for name in ("bm25", "ensemble", "vector_int8"):
+            results["retrieval"][f"{name}_filtered"] = bench_retriever(retrievers[name], queries, filter=scope)
+
+        model = FakeListChatModel(responses=[" ".join(rng.sample(vocabulary, 40)) for _ in range(16)])
+        chain = create_full_chain(ensemble, model=model)
+        results["chain"] = bench_chain(chain, queries[:args.chain_queries])
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(results):
+    print("\n=== Import time ===")
+    for module, stats in results["imports"].items():
+        flag = "  OVER BUDGET" if stats["over_budget"] else ""
+        print(f"{module:>18}: {stats['seconds']:.2f}s (budget {stats['budget']:.1f}s){flag}")
+    if "ingestion" not in results:
+        return
+    print("\n=== Ingestion ===")
+    for stage, stats in results["ingestion"].items():
+        print(f"{stage:>18}: {stats['items']} items in {stats['seconds']:.3f}s ({stats['per_second']}/s)")
+    print("\n=== Retrieval latency (ms) ===")
+    for name, stats in results["retrieval"].items():
+        print(f"{name:>18}: p50 {stats['p50_ms']:.2f}  p90 {stats['p90_ms']:.2f}  p99 {stats['p99_ms']:.2f}")
+    print("\n=== Quantized index ===")
+    for mode, stats in results["quantization"].items():
+        print(f"{mode:>18}: recall@k {stats['recall_at_k']:.3f}, {stats['bytes_per_chunk']:.0f} bytes/chunk "
+              f"(float32 {stats['float32_bytes_per_chunk']})")
+    print("\n=== Chain latency (ms) ===")
+    for name, stats in results["chain"].items():
+        print(f"{name:>20}: p50 {stats['p50_ms']:.2f}  p90 {stats['p90_ms']:.2f}  p99 {stats['p99_ms']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion, retrieval and chain benchmarks.")
+    parser.add_argument("--docs", type=int, default=200, help="number of synthetic documents")
+    parser.add_argument("--words-per-doc", type=int, default=600)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--dimensions", type=int, default=384, help="fake embedding size")
+    parser.add_argument("--csv-rows", type=int, default=100000, help="rows of the synthetic CSV table, 0 to skip")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--chain-queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_SECONDS,
+                        help="seconds each entry module may take to import")
+    parser.add_argument("--imports-only", action="store_true", help="only run the import time check")
+    args = parser.parse_args()
+
+    results = {"config": vars(args)} if args.imports_only else run(args)
+    results["imports"] = bench_imports(args.import_budget)
+    print_report(results)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\nWrote {args.output}")
+    if any(stats["over_budget"] for stats in results["imports"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # this is to quiet parallel tokenizers warning.
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    main()
@@ -0,0 +1,208 @@
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from document_log import save_array
+from metadata_filter import combine_filters
+from slot_index import SlotIndex
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index(SlotIndex):
+    """Persistent BM25 index over an inverted file of NumPy postings.
+
+    Saved postings are stored in CSR form (term -> doc slots, term frequencies) and
+    memory-mapped on load. Documents added since the last save live in small in-memory
+    posting lists, and deletes are tombstones, so neither needs a rebuild; save() drops the
+    tombstones once they make up COMPACT_DEAD_FRACTION of the slots. A query only touches the
+    postings of its own terms, and a metadata filter drops postings before scoring.
+    """
+
+    def __init__(self, directory, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.postings = np.zeros(0, dtype=np.int32)
+        self.freqs = np.zeros(0, dtype=np.float32)
+        self.doc_len = np.zeros(0, dtype=np.float32)
+
+        meta = self._open_slots(directory, "bm25")
+        doc_len = None
+        if meta is not None:
+            indptr = np.load(self._path("indptr"), mmap_mode="r")
+            doc_len = np.load(self._path("doc_len"))
+            if len(indptr) != len(meta["vocab"]) + 1:
+                meta = None
+        # If the arrays disagree with bm25.json a save was interrupted, and starting empty
+        # lets the next sync re-add everything.
+        if self._load_slots(meta, [doc_len]):
+            self.vocab = meta["vocab"]
+            self.indptr = indptr
+            self.postings = np.load(self._path("postings"), mmap_mode="r")
+            self.freqs = np.load(self._path("freqs"), mmap_mode="r")
+            self.doc_len = doc_len
+
+        self.pending = defaultdict(list)
+        self.total_len = float(self.doc_len[self.alive].sum())
+
+    def __iter__(self):
+        return iter(list(self.id_to_slot))
+
+    def add_documents(self, documents: List[Document], ids: List[str]):
+        new = [(doc, doc_id) for doc, doc_id in zip(documents, ids) if doc_id not in self.id_to_slot]
+        if not new:
+            return
+        lengths = []
+        for slot, (doc, doc_id) in enumerate(new, start=len(self.slot_ids)):
+            counts = Counter(tokenize(doc.page_content))
+            for term, count in counts.items():
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                self.pending[term_id].append((slot, count))
+            lengths.append(sum(counts.values()))
+        self._add_slots([doc for doc, _ in new], [doc_id for _, doc_id in new])
+        self.total_len += sum(lengths)
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(lengths, dtype=np.float32)])
+
+    def delete(self, ids: List[str]):
+        for slot in self._delete_slots(ids):
+            self.total_len -= float(self.doc_len[slot])
+
+    def _term_postings(self, term_id):
+        slots = []
+        freqs = []
+        if term_id + 1 < len(self.indptr):
+            start, stop = self.indptr[term_id], self.indptr[term_id + 1]
+            slots.append(self.postings[start:stop])
+            freqs.append(self.freqs[start:stop])
+        if term_id in self.pending:
+            extra = np.asarray(self.pending[term_id], dtype=np.float64).reshape(-1, 2)
+            slots.append(extra[:, 0].astype(np.int32))
+            freqs.append(extra[:, 1].astype(np.float32))
+        if not slots:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        slots = np.concatenate(slots)
+        freqs = np.concatenate(freqs)
+        keep = self.alive[slots]
+        return slots[keep], freqs[keep]
+
+    def search(self, query, k=4, filter=None):
+        """Top `k` documents for `query`, only among those whose metadata passes `filter` (Chroma syntax)."""
+        n_docs = len(self.id_to_slot)
+        if not n_docs:
+            return []
+        avg_len = self.total_len / n_docs
+        # Corpus statistics stay global; the filter only decides which postings get scored.
+        passes = self.metadata.mask(filter) if filter else None
+
+        all_slots = []
+        all_scores = []
+        for term, weight in Counter(tokenize(query)).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            slots, freqs = self._term_postings(term_id)
+            idf = np.log((n_docs - len(slots) + 0.5) / (len(slots) + 0.5) + 1.0)
+            if passes is not None:
+                keep = passes[slots]
+                slots, freqs = slots[keep], freqs[keep]
+            if not len(slots):
+                continue
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[slots] / avg_len)
+            all_slots.append(slots)
+            all_scores.append(weight * idf * freqs * (self.k1 + 1) / (freqs + norm))
+        if not all_slots:
+            return []
+
+        # Accumulate per document over the candidate set only, never the whole corpus.
+        slots, inverse = np.unique(np.concatenate(all_slots), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        docs = self.docs.get(slots[top].tolist())
+        for doc, score in zip(docs, scores[top]):
+            doc.metadata["bm25_score"] = float(score)
+        return docs
+
+    def _compact(self, slots):
+        # Renumber the live slots from 0; `slots` are the merged postings, which hold only live ones.
+        new_slot = np.full(len(self.alive), -1, dtype=np.int32)
+        live = self._compact_slots()
+        new_slot[live] = np.arange(len(live), dtype=np.int32)
+        self.doc_len = self.doc_len[live]
+        return new_slot[slots]
+
+    def save(self):
+        """Write pending postings and tombstones to disk; a no-op if nothing changed since the last save."""
+        if not self.dirty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        n_terms = len(self.vocab)
+        base_counts = np.diff(self.indptr)
+        terms = [np.repeat(np.arange(len(base_counts), dtype=np.int64), base_counts)]
+        slots = [np.asarray(self.postings, dtype=np.int32)]
+        freqs = [np.asarray(self.freqs, dtype=np.float32)]
+        for term_id, entries in self.pending.items():
+            entries = np.asarray(entries, dtype=np.int64).reshape(-1, 2)
+            terms.append(np.full(len(entries), term_id, dtype=np.int64))
+            slots.append(entries[:, 0].astype(np.int32))
+            freqs.append(entries[:, 1].astype(np.float32))
+        terms = np.concatenate(terms)
+        slots = np.concatenate(slots)
+        freqs = np.concatenate(freqs)
+
+        # Merge saved and pending postings, dropping deleted documents.
+        keep = self.alive[slots]
+        terms, slots, freqs = terms[keep], slots[keep], freqs[keep]
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=n_terms), out=indptr[1:])
+
+        if self._needs_compaction():
+            # The document log is rewritten first; bm25.json, written last, then disagrees with
+            # the arrays until the save completes, which __init__ treats as an interrupted save.
+            slots = self._compact(slots)
+        else:
+            self.docs.save()
+        save_array(self._path("indptr"), indptr)
+        save_array(self._path("postings"), slots[order])
+        save_array(self._path("freqs"), freqs[order])
+        save_array(self._path("doc_len"), self.doc_len)
+        self._save_slots({"vocab": self.vocab})
+
+        self.indptr = np.load(self._path("indptr"), mmap_mode="r")
+        self.postings = np.load(self._path("postings"), mmap_mode="r")
+        self.freqs = np.load(self._path("freqs"), mmap_mode="r")
+        self.pending = defaultdict(list)
+
+
+class BM25IndexRetriever(BaseRetriever):
+    index: Any
+    """BM25Index to search."""
+    k: int = 4
+    """Number of documents to return."""
+
+    filter: Optional[dict] = None
+    """Metadata filter (Chroma `where` syntax) applied to every search."""
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun, filter=None
+    ) -> List[Document]:
+        return self.index.search(query, self.k, combine_filters(self.filter, filter))
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, filter=None
+    ) -> List[Document]:
+        # Scoring touches only a few postings in memory, so it runs inline rather than in a thread.
+        return self.index.search(query, self.k, combine_filters(self.filter, filter))
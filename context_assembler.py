@@ -0,0 +1,69 @@
+import re
+
+from tokens import count_tokens
+
+MAX_CONTEXT_TOKENS = 2000
+# Scores set by the retrievers, best first: fused rank, then BM25.
+SCORE_KEYS = ("rrf_score", "bm25_score")
+# A chunk whose word 5-grams are mostly in the context already adds nothing new.
+DUPLICATE_OVERLAP = 0.8
+SHINGLE_SIZE = 5
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+SEPARATOR = "\n\n"
+
+
+def shingles(text):
+    words = text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def rank_documents(docs):
+    # Positions of `docs`, best first by a score every document carries; otherwise the retriever's order.
+    for key in SCORE_KEYS:
+        if docs and all(key in doc.metadata for doc in docs):
+            return sorted(range(len(docs)), key=lambda n: docs[n].metadata[key], reverse=True)
+    return list(range(len(docs)))
+
+
+def trim_to_sentences(text, max_tokens):
+    """The longest run of whole leading sentences of `text` that fits in `max_tokens`."""
+    kept = []
+    for sentence in SENTENCE_RE.split(text):
+        tokens = count_tokens(sentence) + 1
+        if tokens > max_tokens:
+            break
+        kept.append(sentence)
+        max_tokens -= tokens
+    return " ".join(kept)
+
+
+def assemble_context(docs, max_tokens=MAX_CONTEXT_TOKENS):
+    """Pack the best retrieved chunks into at most `max_tokens` tokens of prompt context.
+
+    Chunks are chosen in score order, near-duplicates of what is already chosen are skipped,
+    and the chunk that crosses the budget is cut at a sentence boundary. The chosen chunks keep
+    the order the retriever returned them in, so a deliberate ordering such as the
+    LongContextReorder in filter.create_retriever is not undone.
+    """
+    docs = list(docs)
+    separator_tokens = count_tokens(SEPARATOR)
+    budget = max_tokens
+    parts = {}
+    seen = set()
+    for n in rank_documents(docs):
+        text = docs[n].page_content.strip()
+        doc_shingles = shingles(text)
+        if not doc_shingles or len(doc_shingles & seen) >= DUPLICATE_OVERLAP * len(doc_shingles):
+            continue
+        cost = count_tokens(text) + (separator_tokens if parts else 0)
+        if cost > budget:
+            text = trim_to_sentences(text, budget - (separator_tokens if parts else 0))
+            if text:
+                parts[n] = text
+            break
+        parts[n] = text
+        seen |= doc_shingles
+        budget -= cost
+    return SEPARATOR.join(parts[n] for n in sorted(parts))
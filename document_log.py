@@ -0,0 +1,77 @@
+import json
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+def save_array(path, array):
+    # Write next to the target and rename, so readers never map a half-written file.
+    tmp_path = path[:-len(".npy")] + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+class DocumentLog:
+    """Append-only JSON-lines file of documents, addressed by slot number.
+
+    Only the byte offset of each slot is kept in memory; documents are read back on demand.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, "documents.jsonl")
+        self.offsets_path = os.path.join(directory, "document_offsets.npy")
+        if os.path.exists(self.offsets_path):
+            self.offsets = np.load(self.offsets_path).tolist()
+        else:
+            self.offsets = []
+        # Drop anything appended after the last save, it has no slot.
+        if os.path.exists(self.path):
+            end = self.offsets[-1][1] if self.offsets else 0
+            if end > os.path.getsize(self.path):
+                # A compaction was interrupted between replacing the file and its offsets.
+                self.offsets, end = [], 0
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, docs, ids):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as f:
+            for doc, doc_id in zip(docs, ids):
+                line = json.dumps({"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata},
+                                  default=str).encode("utf-8") + b"\n"
+                start = f.tell()
+                f.write(line)
+                self.offsets.append((start, start + len(line)))
+
+    def get(self, slots):
+        docs = []
+        with open(self.path, "rb") as f:
+            for slot in slots:
+                start, end = self.offsets[slot]
+                f.seek(start)
+                record = json.loads(f.read(end - start))
+                docs.append(Document(id=record["id"], page_content=record["page_content"],
+                                     metadata=record["metadata"]))
+        return docs
+
+    def compact(self, slots):
+        """Keep only `slots`, renumbered from 0 in the given order, and save."""
+        tmp_path = self.path + ".tmp"
+        offsets = []
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            for slot in slots:
+                start, end = self.offsets[slot]
+                src.seek(start)
+                line = src.read(end - start)
+                offsets.append((dst.tell(), dst.tell() + len(line)))
+                dst.write(line)
+        os.replace(tmp_path, self.path)
+        self.offsets = offsets
+        self.save()
+
+    def save(self):
+        save_array(self.offsets_path, np.asarray(self.offsets, dtype=np.int64).reshape(-1, 2))
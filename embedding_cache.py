@@ -0,0 +1,261 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metrics import REGISTRY
+
+CACHE_PATH = os.path.join("store", "embedding_cache.sqlite")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+HOT_CACHE_SIZE = 2048
+SQL_BATCH = 500
+# Access times of cache hits are written in batches, not on every read.
+ACCESS_FLUSH_SIZE = 1000
+ACCESS_FLUSH_SECONDS = 30
+# Settings that cannot change a vector (credentials, clients, retries, batching); everything else is in the key.
+OPERATIONAL_SETTINGS_RE = re.compile(r"key|token|secret|password|client|timeout|retr|batch|progress|headers|"
+                                     r"proxy|parallel|concurrency|rate|cache|^chunk_size$", re.IGNORECASE)
+
+
+def _is_plain(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return True
+    if isinstance(value, (list, tuple)):
+        return all(_is_plain(v) for v in value)
+    if isinstance(value, dict):
+        return all(isinstance(k, str) and _is_plain(v) for k, v in value.items())
+    return False
+
+
+def model_settings(embeddings):
+    """The settings of `embeddings` that can affect its output, e.g. model, dimensions, encode_kwargs."""
+    fields = getattr(type(embeddings), "model_fields", None)
+    names = fields if fields is not None else vars(embeddings)
+    settings = {}
+    for name in sorted(names):
+        if name.startswith("_") or OPERATIONAL_SETTINGS_RE.search(name):
+            continue
+        value = getattr(embeddings, name, None)
+        # Secrets held as SecretStr and client objects are not plain values and stay out too.
+        if _is_plain(value):
+            settings[name] = value
+    return settings
+
+
+def model_fingerprint(embeddings):
+    # Look through wrappers such as EmbeddingScheduler to the model that produces the vectors.
+    while hasattr(embeddings, "embedding"):
+        embeddings = embeddings.embedding
+    settings = json.dumps(model_settings(embeddings), sort_keys=True, default=str)
+    return f"{type(embeddings).__name__}:{hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]}"
+
+
+class EmbeddingStore:
+    """SQLite table of float32 vectors keyed by hash, evicted least-recently-used by size.
+
+    Reads only select; the access times that drive eviction are buffered and written in one
+    batch every ACCESS_FLUSH_SIZE hits or ACCESS_FLUSH_SECONDS, and before evicting.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                          "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        self.accessed = {}
+        self.last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        with self.lock:
+            for i in range(0, len(keys), SQL_BATCH):
+                batch = keys[i:i + SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = self.conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch)
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            self.accessed.update((key, now) for key in found)
+            if len(self.accessed) >= ACCESS_FLUSH_SIZE or time.monotonic() - self.last_flush > ACCESS_FLUSH_SECONDS:
+                self._flush_accessed()
+                self.conn.commit()
+        return found
+
+    def _flush_accessed(self):
+        if self.accessed:
+            self.conn.executemany("UPDATE embeddings SET accessed = ? WHERE key = ?",
+                                  [(now, key) for key, now in self.accessed.items()])
+            self.accessed = {}
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush_accessed()
+            self.conn.commit()
+
+    def put_many(self, items):
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self.lock:
+            self._flush_accessed()
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, size, accessed) "
+                                  "VALUES (?, ?, ?, ?)", rows)
+            self.total_bytes += sum(row[2] for row in rows)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # Free down to 90% of the budget so eviction does not run on every insert.
+        target = self.total_bytes - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in self.conn.execute("SELECT key, size FROM embeddings ORDER BY accessed"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self.conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+    # One store per file so every retriever and collection in the process shares it.
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = EmbeddingStore(path, max_bytes)
+        return _stores[path]
+
+
+_hot = OrderedDict()
+_hot_lock = threading.Lock()
+
+
+def _hot_get(key):
+    with _hot_lock:
+        vector = _hot.get(key)
+        if vector is not None:
+            _hot.move_to_end(key)
+        return vector
+
+
+def _hot_put(key, vector):
+    with _hot_lock:
+        _hot[key] = vector
+        _hot.move_to_end(key)
+        while len(_hot) > HOT_CACHE_SIZE:
+            _hot.popitem(last=False)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the model for texts it has never seen.
+
+    Vectors are keyed on (model settings, text hash) in a shared on-disk store;
+    query embeddings are also kept in a small in-process LRU tier.
+    """
+
+    def __init__(self, embedding, store=None):
+        self.embedding = embedding
+        self.store = store or get_embedding_store()
+        self.namespace = model_fingerprint(embedding)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def lookup(self, texts):
+        """Cached vectors for `texts` (None where missing) without calling the model."""
+        keys = [self.key(t) for t in texts]
+        found = self.store.get_many(list(set(keys)))
+        return [found.get(k) for k in keys]
+
+    def _missing(self, texts):
+        keys = [self.key(t) for t in texts]
+        found = self.store.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        REGISTRY.inc("rag_cache_requests_total", len(keys) - len(missing), cache="embedding", result="hit")
+        REGISTRY.inc("rag_cache_requests_total", len(missing), cache="embedding", result="miss")
+        return keys, found, missing
+
+    def _remember(self, found, missing, vectors):
+        computed = dict(zip(missing, vectors))
+        self.store.put_many(computed.items())
+        found.update({k: np.asarray(v, dtype=np.float32) for k, v in computed.items()})
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._missing(texts)
+        if missing:
+            self._remember(found, missing, self.embedding.embed_documents(list(missing.values())))
+        return [found[k].tolist() for k in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # The store is SQLite on local disk; keep its reads and writes off the event loop.
+        keys, found, missing = await asyncio.to_thread(self._missing, texts)
+        if missing:
+            vectors = await self.embedding.aembed_documents(list(missing.values()))
+            await asyncio.to_thread(self._remember, found, missing, vectors)
+        return [found[k].tolist() for k in keys]
+
+    def _cached_query(self, key):
+        vector = _hot_get(key)
+        if vector is None:
+            vector = self.store.get_many([key]).get(key)
+            if vector is not None:
+                _hot_put(key, vector)
+        REGISTRY.inc("rag_cache_requests_total", cache="embedding", result="miss" if vector is None else "hit")
+        return vector
+
+    def _remember_query(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        self.store.put_many([(key, vector)])
+        _hot_put(key, vector)
+        return vector
+
+    def embed_query(self, text: str) -> List[float]:
+        with REGISTRY.timer("embed_query"):
+            key = "q:" + self.key(text)
+            vector = self._cached_query(key)
+            if vector is None:
+                vector = self._remember_query(key, self.embedding.embed_query(text))
+            return vector.tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        with REGISTRY.timer("embed_query"):
+            key = "q:" + self.key(text)
+            vector = _hot_get(key)
+            if vector is not None:
+                REGISTRY.inc("rag_cache_requests_total", cache="embedding", result="hit")
+            else:
+                vector = await asyncio.to_thread(self._cached_query, key)
+            if vector is None:
+                vector = await self.embedding.aembed_query(text)
+                vector = await asyncio.to_thread(self._remember_query, key, vector)
+            return vector.tolist()
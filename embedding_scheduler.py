@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self, tokens):
+        # Take the tokens if available and return 0, otherwise return how long to wait.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        while wait := self._take(tokens):
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=1):
+        while wait := self._take(tokens):
+            await asyncio.sleep(wait)
+
+
+def is_rate_limit_error(exc):
+    status = getattr(exc, "status_code", None)
+    response = getattr(exc, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if status == 429:
+        return True
+    message = str(exc).lower()
+    return "429" in message or "rate limit" in message or "too many requests" in message
+
+
+def retry_after(exc):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingScheduler(Embeddings):
+    """Wraps an embedding model with batching, bounded concurrency and rate limiting.
+
+    Texts are split into `batch_size` batches and embedded on up to `max_workers` threads.
+    `requests_per_second` caps calls to the provider with a token bucket, and calls that fail
+    with HTTP 429 are retried with exponential backoff. For local models `cpu_share` (0-1]
+    makes each worker idle in proportion to the time it spent embedding.
+    """
+
+    def __init__(self, embedding, batch_size=64, max_workers=4, requests_per_second=None,
+                 max_retries=6, initial_backoff=1.0, max_backoff=60.0, cpu_share=None):
+        if cpu_share is not None and not 0 < cpu_share <= 1:
+            raise ValueError("cpu_share must be in (0, 1]")
+        self.embedding = embedding
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(requests_per_second) if requests_per_second else None
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.cpu_share = cpu_share
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="embed")
+            return self._executor
+
+    def _call(self, fn, arg):
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            if self.bucket:
+                self.bucket.acquire()
+            start = time.monotonic()
+            try:
+                result = fn(arg)
+            except Exception as exc:
+                if attempt == self.max_retries or not is_rate_limit_error(exc):
+                    raise
+                delay = retry_after(exc) or min(self.max_backoff, backoff) * (0.5 + random.random())
+                logging.warning(f"Embedding rate limited, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                backoff *= 2
+                continue
+            if self.cpu_share and self.cpu_share < 1:
+                elapsed = time.monotonic() - start
+                time.sleep(elapsed * (1 - self.cpu_share) / self.cpu_share)
+            return result
+
+    async def _acall(self, fn, arg):
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            if self.bucket:
+                await self.bucket.aacquire()
+            start = time.monotonic()
+            try:
+                result = await fn(arg)
+            except Exception as exc:
+                if attempt == self.max_retries or not is_rate_limit_error(exc):
+                    raise
+                delay = retry_after(exc) or min(self.max_backoff, backoff) * (0.5 + random.random())
+                logging.warning(f"Embedding rate limited, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                backoff *= 2
+                continue
+            if self.cpu_share and self.cpu_share < 1:
+                elapsed = time.monotonic() - start
+                await asyncio.sleep(elapsed * (1 - self.cpu_share) / self.cpu_share)
+            return result
+
+    def _async_method(self, name):
+        # Use the model's native async method when it has one, otherwise run the sync one in a thread.
+        method = getattr(self.embedding, "a" + name, None)
+        if method:
+            return method
+        sync_method = getattr(self.embedding, name)
+        return lambda arg: asyncio.to_thread(sync_method, arg)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.max_workers == 1:
+            return [v for batch in batches for v in self._call(self.embedding.embed_documents, batch)]
+
+        # Keep a bounded number of batches in flight so a huge input does not queue all at once.
+        vectors = []
+        pending = deque()
+        for batch in batches:
+            if len(pending) >= 2 * self.max_workers:
+                vectors.extend(pending.popleft().result())
+            pending.append(self.executor.submit(self._call, self.embedding.embed_documents, batch))
+        while pending:
+            vectors.extend(pending.popleft().result())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(self.embedding.embed_query, text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        embed = self._async_method("embed_documents")
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def run(batch):
+            async with semaphore:
+                return await self._acall(embed, batch)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+        return [v for vectors in results for v in vectors]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self._acall(self._async_method("embed_query"), text)
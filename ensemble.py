@@ -1,25 +1,32 @@
 import os
 
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
 from langchain_core.output_parsers import StrOutputParser
 
-from basic_chain import get_model
+from bm25_index import BM25Index, BM25IndexRetriever
+from hybrid_retriever import HybridRetriever
 from rag_chain import make_rag_chain
-from remote_loader import load_web_page
 from splitter import split_documents
-from vector_store import create_vector_db
+from vector_store import as_retriever, collection_lock, create_vector_db, store_path
 from dotenv import load_dotenv
 
 
-def ensemble_retriever_from_docs(docs, embeddings=None):
+# A `filter` (Chroma `where` syntax) limits every search to matching chunks; a filter passed
+# per query, e.g. retriever.invoke(question, filter=...), narrows it further.
+def ensemble_retriever_from_docs(docs, embeddings=None, collection_name="chroma", filter=None):
     texts = split_documents(docs)
-    vs = create_vector_db(texts, embeddings)
-    vs_retriever = vs.as_retriever()
-
-    bm25_retriever = BM25Retriever.from_texts([t.page_content for t in texts])
-
-    ensemble_retriever = EnsembleRetriever(
+    # The BM25 index lives next to the Chroma store and is updated by the same sync,
+    # so a restart memory-maps it instead of re-tokenizing the corpus. Server workers starting
+    # together take turns; the ones after the first find it up to date and write nothing.
+    with collection_lock(collection_name):
+        bm25_index = BM25Index(os.path.join(store_path(collection_name), "bm25"))
+        vs = create_vector_db(texts, embeddings, collection_name=collection_name, indexes=[bm25_index])
+        bm25_index.save()
+    vs_retriever = as_retriever(vs, search_kwargs={"filter": filter} if filter else {})
+
+    bm25_retriever = BM25IndexRetriever(index=bm25_index, filter=filter)
+
+    # Both retrievers are queried concurrently and fused with reciprocal rank fusion.
+    ensemble_retriever = HybridRetriever(
         retrievers=[bm25_retriever, vs_retriever],
         weights=[0.5, 0.5])
 
@@ -27,6 +34,9 @@ def ensemble_retriever_from_docs(docs, embeddings=None):
 
 
 def main():
+    from basic_chain import get_model
+    from remote_loader import load_web_page
+
     load_dotenv()
 
     problems_of_philosophy_by_russell = "https://www.gutenberg.org/ebooks/5827.html.images"
@@ -1,32 +1,32 @@
-from langchain.retrievers.document_compressors import DocumentCompressorPipeline
-from langchain_community.document_transformers import EmbeddingsRedundantFilter, LongContextReorder
-from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.retrievers import EnsembleRetriever, ContextualCompressionRetriever, MergerRetriever
-from langchain.chains import RetrievalQA
-
-from basic_chain import get_model
-from ensemble import ensemble_retriever_from_docs
-from remote_loader import load_web_page
-from vector_store import create_vector_db
+from hybrid_retriever import HybridRetriever
+from model_registry import get_embeddings
+from redundancy_filter import StoredEmbeddingsRedundantFilter
+from vector_store import as_retriever, create_vector_db
 
 from dotenv import load_dotenv
 
 
-def create_retriever(texts):
-    dense_embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    sparse_embeddings = HuggingFaceBgeEmbeddings(model_name="BAAI/bge-large-en",
-                                                 encode_kwargs={'normalize_embeddings': False})
-    dense_vs = create_vector_db(texts, collection_name="dense", embeddings=dense_embeddings)
-    sparse_vs = create_vector_db(texts, collection_name="sparse", embeddings=sparse_embeddings)
+def create_retriever(texts, dense_embeddings=None, sparse_embeddings=None, quantization=None):
+    from langchain.retrievers import ContextualCompressionRetriever
+    from langchain.retrievers.document_compressors import DocumentCompressorPipeline
+    from langchain_community.document_transformers import LongContextReorder
+
+    dense_embeddings = dense_embeddings or get_embeddings("all-MiniLM-L6-v2")
+    sparse_embeddings = sparse_embeddings or get_embeddings("BAAI/bge-large-en", provider="huggingface-bge",
+                                                            encode_kwargs={'normalize_embeddings': False})
+    dense_vs = create_vector_db(texts, collection_name="dense", embeddings=dense_embeddings,
+                                quantization=quantization)
+    sparse_vs = create_vector_db(texts, collection_name="sparse", embeddings=sparse_embeddings,
+                                 quantization=quantization)
     vector_stores = [dense_vs, sparse_vs]
 
-    emb_filter = EmbeddingsRedundantFilter(embeddings=sparse_embeddings)
+    # Every chunk is in the sparse store, so its stored vectors are reused instead of re-embedding.
+    emb_filter = StoredEmbeddingsRedundantFilter(vectorstore=sparse_vs)
     reordering = LongContextReorder()
     pipeline = DocumentCompressorPipeline(transformers=[emb_filter, reordering])
 
-    base_retrievers = [vs.as_retriever() for vs in vector_stores]
-    lotr = MergerRetriever(retrievers=base_retrievers)
+    base_retrievers = [as_retriever(vs) for vs in vector_stores]
+    lotr = HybridRetriever(retrievers=base_retrievers)
 
     compression_retriever_reordered = ContextualCompressionRetriever(
         base_compressor=pipeline, base_retriever=lotr, search_kwargs={"k": 5, "include_metadata": True}
@@ -35,6 +35,12 @@ def create_retriever(texts):
 
 
 def main():
+    from langchain.chains import RetrievalQA
+
+    from basic_chain import get_model
+    from ensemble import ensemble_retriever_from_docs
+    from remote_loader import load_web_page
+
     load_dotenv()
 
     problems_of_philosophy_by_russell = "https://www.gutenberg.org/ebooks/5827.html.images"
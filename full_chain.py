@@ -1,18 +1,19 @@
 import os
 
 from dotenv import load_dotenv
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.prompts import ChatPromptTemplate
 
 from basic_chain import get_model
-from filter import ensemble_retriever_from_docs
+from ensemble import ensemble_retriever_from_docs
 from local_loader import load_txt_files
 from memory import create_memory_chain
+from metrics import MetricsCallbackHandler
 from rag_chain import make_rag_chain
 
 
-def create_full_chain(retriever, huggingfacehub_api_token=None, chat_memory=ChatMessageHistory()):
-    model = get_model("llama-3.1-8b-instant", huggingfacehub_api_token=huggingfacehub_api_token)
+def create_full_chain(retriever, huggingfacehub_api_token=None, chat_memory=None, semantic_cache=None,
+                      history_store=None, model=None, filter=None):
+    model = model or get_model("llama-3.1-8b-instant", huggingfacehub_api_token=huggingfacehub_api_token)
     system_prompt = """You are a helpful AI assistant for busy professionals trying to improve their health.
     Use the following context and the users' chat history to help the user:
     If you don't know the answer, just say that you don't know. 
@@ -28,15 +29,26 @@ def create_full_chain(retriever, huggingfacehub_api_token=None, chat_memory=Chat
         ]
     )
 
-    rag_chain = make_rag_chain(model, retriever, rag_prompt=prompt)
-    chain = create_memory_chain(model, rag_chain, chat_memory)
-    return chain
+    # The speculative retrieval in the memory chain stands in for the RAG chain's, so both get `filter`.
+    rag_chain = make_rag_chain(model, retriever, rag_prompt=prompt, semantic_cache=semantic_cache, filter=filter)
+    chain = create_memory_chain(model, rag_chain, chat_memory, speculative_retriever=retriever,
+                                history_store=history_store, filter=filter)
+    # Per-stage latency, token and retrieval metrics for every turn; see metrics.REGISTRY.
+    return chain.with_config(callbacks=[MetricsCallbackHandler()])
 
 
-def ask_question(chain, query):
+def ask_question(chain, query, session_id="default", filter=None):
     for token in chain.stream(
-        {"question": query},
-        config={"configurable": {"session_id": "foo"}}
+        {"question": query, "filter": filter},
+        config={"configurable": {"session_id": session_id}}
+    ):
+        yield token
+
+
+async def aask_question(chain, query, session_id="default", filter=None):
+    async for token in chain.astream(
+        {"question": query, "filter": filter},
+        config={"configurable": {"session_id": session_id}}
     ):
         yield token
 
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Sequence
+
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+HISTORY_DB_URL = f"sqlite:///{os.path.join('store', 'chat_history.sqlite')}"
+MAX_CACHED_SESSIONS = 1000
+SESSION_TTL = 7 * 24 * 3600  # one week
+EXPIRE_INTERVAL = 60
+
+
+class LRUCache:
+    """Thread-safe mapping that drops the least recently used entries and entries idle for `ttl` seconds."""
+
+    def __init__(self, max_size=MAX_CACHED_SESSIONS, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_or_create(self, key, factory):
+        now = time.time()
+        with self.lock:
+            if key in self.items:
+                value, last_used = self.items[key]
+                if self.ttl is None or now - last_used <= self.ttl:
+                    self.items[key] = (value, now)
+                    self.items.move_to_end(key)
+                    return value
+            value = factory()
+            self.items[key] = (value, now)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+            return value
+
+    def pop(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+
+class InMemoryHistoryStore:
+    """Per-session chat histories held in process memory, LRU-bounded and expiring after `ttl`."""
+
+    def __init__(self, max_sessions=MAX_CACHED_SESSIONS, ttl=SESSION_TTL):
+        self.sessions = LRUCache(max_sessions, ttl)
+
+    def get(self, session_id) -> BaseChatMessageHistory:
+        return self.sessions.get_or_create(session_id, ChatMessageHistory)
+
+
+class SQLChatHistory(BaseChatMessageHistory):
+    """One session's messages, written through to SQL and cached in memory.
+
+    Other processes (e.g. API server workers) may write to the same session, so every read
+    checks the cache against the message count and last id in the table, fetches only rows
+    newer than the cache, and reloads the session if anything else changed.
+    """
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+        self._messages = None
+        self._last_id = None
+        self.lock = threading.Lock()
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        with self.lock:
+            count, last_id = self.store.stats(self.session_id)
+            if self._messages is not None and (count, last_id) != (len(self._messages), self._last_id):
+                rows = self.store.load(self.session_id, after_id=self._last_id or 0)
+                if len(self._messages) + len(rows) == count:
+                    self._extend(rows)
+                else:
+                    self._messages = None
+            if self._messages is None:
+                self._messages, self._last_id = [], None
+                self._extend(self.store.load(self.session_id))
+            return list(self._messages)
+
+    def _extend(self, rows):
+        if rows:
+            self._messages.extend(messages_from_dict([json.loads(message) for _, message in rows]))
+            self._last_id = rows[-1][0]
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        # The new rows are picked up, with their ids, by the next read.
+        with self.lock:
+            self.store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.store.remove(self.session_id)
+            self._messages, self._last_id = [], None
+
+
+class SQLHistoryStore:
+    """Per-session chat histories in a SQL database (SQLite by default) that survive restarts.
+
+    Connections come from one pooled SQLAlchemy engine shared by all sessions, recently used
+    sessions are cached in memory, and sessions idle for longer than `ttl` are deleted.
+    """
+
+    def __init__(self, db_url=HISTORY_DB_URL, ttl=SESSION_TTL, max_cached_sessions=MAX_CACHED_SESSIONS,
+                 pool_size=5):
+        # Imported here so the in-memory stores do not pay for loading SQLAlchemy.
+        from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, create_engine
+
+        if db_url.startswith("sqlite:///"):
+            os.makedirs(os.path.dirname(os.path.abspath(db_url[len("sqlite:///"):])), exist_ok=True)
+        self.engine = create_engine(db_url, pool_size=pool_size, pool_pre_ping=True,
+                                    connect_args={"check_same_thread": False} if db_url.startswith("sqlite") else {})
+        self.ttl = ttl
+        metadata = MetaData()
+        self.sessions_table = Table(
+            "chat_sessions", metadata,
+            Column("session_id", String(255), primary_key=True),
+            Column("updated_at", Float, nullable=False, index=True),
+        )
+        self.messages_table = Table(
+            "chat_messages", metadata,
+            Column("id", Integer, primary_key=True, autoincrement=True),
+            Column("session_id", String(255), nullable=False, index=True),
+            Column("message", Text, nullable=False),
+            # Never reuse ids of deleted rows, so (count, max id) identifies a session's contents.
+            sqlite_autoincrement=True,
+        )
+        metadata.create_all(self.engine)
+        self.cache = LRUCache(max_cached_sessions, ttl)
+        self.last_expired = 0.0
+
+    def get(self, session_id) -> BaseChatMessageHistory:
+        self.expire()
+        return self.cache.get_or_create(session_id, lambda: SQLChatHistory(self, session_id))
+
+    def stats(self, session_id):
+        """Number of stored messages of the session and the id of the last one."""
+        from sqlalchemy import func
+
+        table = self.messages_table
+        query = (table.select().with_only_columns(func.count(table.c.id), func.max(table.c.id))
+                 .where(table.c.session_id == session_id))
+        with self.engine.connect() as conn:
+            return tuple(conn.execute(query).one())
+
+    def load(self, session_id, after_id=0):
+        """(id, serialized message) rows of the session with ids above `after_id`, oldest first."""
+        table = self.messages_table
+        query = (table.select().with_only_columns(table.c.id, table.c.message)
+                 .where(table.c.session_id == session_id, table.c.id > after_id)
+                 .order_by(table.c.id))
+        with self.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def append(self, session_id, messages):
+        rows = [{"session_id": session_id, "message": json.dumps(message_to_dict(m))} for m in messages]
+        with self.engine.begin() as conn:
+            if rows:
+                conn.execute(self.messages_table.insert(), rows)
+            self._touch(conn, session_id)
+
+    def _touch(self, conn, session_id):
+        table = self.sessions_table
+        updated = conn.execute(table.update().where(table.c.session_id == session_id)
+                               .values(updated_at=time.time()))
+        if not updated.rowcount:
+            conn.execute(table.insert().values(session_id=session_id, updated_at=time.time()))
+
+    def remove(self, session_id):
+        with self.engine.begin() as conn:
+            conn.execute(self.messages_table.delete().where(self.messages_table.c.session_id == session_id))
+            conn.execute(self.sessions_table.delete().where(self.sessions_table.c.session_id == session_id))
+        self.cache.pop(session_id)
+
+    def expire(self):
+        now = time.time()
+        if self.ttl is None or now - self.last_expired < EXPIRE_INTERVAL:
+            return
+        self.last_expired = now
+        cutoff = now - self.ttl
+        stale = (self.sessions_table.select().with_only_columns(self.sessions_table.c.session_id)
+                 .where(self.sessions_table.c.updated_at < cutoff))
+        with self.engine.begin() as conn:
+            conn.execute(self.messages_table.delete().where(self.messages_table.c.session_id.in_(stale)))
+            conn.execute(self.sessions_table.delete().where(self.sessions_table.c.updated_at < cutoff))
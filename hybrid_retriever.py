@@ -0,0 +1,186 @@
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from typing import List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+from pydantic import PrivateAttr
+
+# The child pool and hold count of the async child call running in the current task, if any.
+_current_call = contextvars.ContextVar("hybrid_child_call", default=None)
+
+
+def doc_key(doc):
+    return doc.id or doc.page_content
+
+
+class ChildPool:
+    """Threads and a cap on unfinished calls for one child retriever.
+
+    A child that hangs only ties up its own threads; once `max_pending` of its calls are
+    unfinished, further calls are refused at once instead of queueing behind them.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retriever")
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Future of fn(*args, **kwargs), or None if the child is saturated."""
+        if not self.pending.acquire(blocking=False):
+            return None
+        future = self.executor.submit(fn, *args, **kwargs)
+        # Released when the call returns, or when it is cancelled before it started.
+        future.add_done_callback(self._release)
+        return future
+
+    def start(self, make_awaitable):
+        """Task awaiting make_awaitable(), or None if the child is saturated.
+
+        The call keeps its slot until the task and every thread it started through
+        run_in_child_executor have finished, so a timed-out call whose thread is still stuck
+        goes on counting against `max_pending`.
+        """
+        if not self.pending.acquire(blocking=False):
+            return None
+        holds = [1]
+        token = _current_call.set((self, holds))
+        try:
+            task = asyncio.ensure_future(make_awaitable())
+        finally:
+            _current_call.reset(token)
+        task.add_done_callback(lambda _: self._drop(holds))
+        return task
+
+    def _hold(self, holds):
+        with self.lock:
+            holds[0] += 1
+
+    def _drop(self, holds):
+        with self.lock:
+            holds[0] -= 1
+            done = holds[0] == 0
+        if done:
+            self.pending.release()
+
+    def _release(self, _):
+        self.pending.release()
+
+
+async def run_in_child_executor(fn, *args, **kwargs):
+    """Await fn(*args, **kwargs) in a thread: the calling child's own threads when it runs under
+    a HybridRetriever, so a hung call stays within that child's limits, else the default executor."""
+    call = _current_call.get()
+    if call is None:
+        return await run_in_executor(None, fn, *args, **kwargs)
+    pool, holds = call
+    pool._hold(holds)
+    context = contextvars.copy_context()
+    future = pool.executor.submit(context.run, partial(fn, *args, **kwargs))
+    future.add_done_callback(lambda _: pool._drop(holds))
+    return await asyncio.wrap_future(future)
+
+
+class HybridRetriever(BaseRetriever):
+    """Queries child retrievers concurrently and fuses their results with reciprocal rank fusion.
+
+    Children that fail or do not answer within `timeout` seconds are left out of the fusion,
+    so latency is bounded by the slowest child that answers in time rather than by the sum.
+    """
+
+    retrievers: List[BaseRetriever]
+    """Child retrievers to query."""
+    weights: Optional[List[float]] = None
+    """Weight of each child in the fusion, equal if not given."""
+    timeout: float = 10.0
+    """Seconds to wait for the children before fusing whatever has arrived."""
+    top_k: int = 10
+    """Number of leading results from each child that take part in the fusion."""
+    k: Optional[int] = None
+    """Number of fused documents to return, all of them if None."""
+    c: int = 60
+    """Rank constant of reciprocal rank fusion."""
+    max_workers: int = 8
+    """Threads each child gets for sync queries."""
+    max_pending: int = 64
+    """Unfinished calls a child may have (e.g. hung ones) before further queries skip it."""
+
+    _pools: Optional[List[ChildPool]] = PrivateAttr(default=None)
+    _pools_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _child_pools(self):
+        # Each child has its own threads, so a slow child never delays the others' calls.
+        with self._pools_lock:
+            if self._pools is None:
+                self._pools = [ChildPool(self.max_workers, self.max_pending) for _ in self.retrievers]
+            return self._pools
+
+    def _collect(self, calls):
+        results = []
+        for weight, retriever, call in zip(self._weights(), self.retrievers, calls):
+            name = type(retriever).__name__
+            if call is None:
+                logging.warning(f"{name} has {self.max_pending} calls pending, skipping it")
+            elif not call.done():
+                call.cancel()
+                logging.warning(f"{name} timed out after {self.timeout}s, skipping it")
+            elif call.exception():
+                logging.warning(f"{name} failed, skipping it: {call.exception()}")
+            else:
+                results.append((weight, call.result()))
+        return results
+
+    def _acall(self, retriever, query, config, kwargs):
+        if type(retriever)._aget_relevant_documents is BaseRetriever._aget_relevant_documents:
+            # A sync-only child would run on the event loop's shared default executor; use its own threads.
+            return run_in_child_executor(retriever.invoke, query, config, **kwargs)
+        return retriever.ainvoke(query, config, **kwargs)
+
+    def _weights(self):
+        return self.weights or [1.0 / len(self.retrievers)] * len(self.retrievers)
+
+    def fuse(self, results):
+        scores = {}
+        docs = {}
+        for weight, child_docs in results:
+            for rank, doc in enumerate(child_docs[:self.top_k], start=1):
+                key = doc_key(doc)
+                scores[key] = scores.get(key, 0.0) + weight / (self.c + rank)
+                docs.setdefault(key, doc)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        fused = []
+        for key in ranked:
+            doc = docs[key]
+            doc.metadata["rrf_score"] = scores[key]
+            fused.append(doc)
+        return fused
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs
+    ) -> List[Document]:
+        futures = [
+            pool.submit(retriever.invoke, query, config={"callbacks": run_manager.get_child(f"retriever_{i}")},
+                        **kwargs)
+            for i, (retriever, pool) in enumerate(zip(self.retrievers, self._child_pools()))
+        ]
+        wait([future for future in futures if future], timeout=self.timeout)
+        return self.fuse(self._collect(futures))
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, **kwargs
+    ) -> List[Document]:
+        tasks = [
+            pool.start(partial(self._acall, retriever, query,
+                               {"callbacks": run_manager.get_child(f"retriever_{i}")}, kwargs))
+            for i, (retriever, pool) in enumerate(zip(self.retrievers, self._child_pools()))
+        ]
+        if any(tasks):
+            await asyncio.wait([task for task in tasks if task], timeout=self.timeout)
+        return self.fuse(self._collect(tasks))
@@ -1,10 +1,13 @@
+import csv
+import hashlib
+import io
+import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from pypdf import PdfReader
-from langchain.docstore.document import Document
+from langchain_core.documents import Document
 from langchain_community.document_loaders import TextLoader
-from langchain_community.document_loaders.csv_loader import CSVLoader
 
 
 def list_txt_files(data_dir="./data"):
@@ -13,45 +16,246 @@ def list_txt_files(data_dir="./data"):
         yield str(path)
 
 
-def load_txt_files(data_dir="./data"):
-    docs = []
+def lazy_load_txt_files(data_dir="./data"):
     paths = list_txt_files(data_dir)
     for path in paths:
         print(f"Loading {path}")
         loader = TextLoader(path)
-        docs.extend(loader.load())
-    return docs
+        yield from loader.lazy_load()
 
 
-def load_csv_files(data_dir="./data"):
-    docs = []
-    paths = Path(data_dir).glob('**/*.csv')
-    for path in paths:
-        loader = CSVLoader(file_path=str(path))
-        docs.extend(loader.load())
-    return docs
+def load_txt_files(data_dir="./data"):
+    return list(lazy_load_txt_files(data_dir))
+
+
+TABLE_BATCH_ROWS = 65536
+TABLE_BLOCK_BYTES = 16 << 20
+
+
+def iter_record_batches(path, batch_size=TABLE_BATCH_ROWS):
+    """Record batches of a CSV or Parquet file, read incrementally; CSV values are kept as text."""
+    import pyarrow as pa
+
+    if str(path).endswith(".parquet"):
+        import pyarrow.parquet as pq
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+        return
+
+    import pyarrow.csv as pacsv
+    read_options = pacsv.ReadOptions(block_size=TABLE_BLOCK_BYTES)
+    with pacsv.open_csv(path, read_options=read_options) as reader:
+        names = reader.schema.names
+    convert_options = pacsv.ConvertOptions(column_types={name: pa.string() for name in names})
+    with pacsv.open_csv(path, read_options=read_options, convert_options=convert_options) as reader:
+        for batch in reader:
+            # CSV blocks are sized in bytes; re-slice so batches stay bounded in rows as well.
+            for start in range(0, batch.num_rows, batch_size):
+                yield batch.slice(start, batch_size)
+
+
+def render_rows(batch, columns):
+    """The "column: value" text of every row of `batch`, built column-wise in Arrow rather than per row."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    lines = []
+    for name in columns:
+        values = pc.utf8_trim_whitespace(pc.fill_null(pc.cast(batch.column(name), pa.string()), ""))
+        lines.append(pc.binary_join_element_wise(f"{name.strip()}: ", values, ""))
+    return pc.binary_join_element_wise(*lines, "\n").to_pylist()
+
+
+def _cell(value):
+    # Formatted as CSVLoader does: missing cells print as None, extra cells are comma-joined.
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, list):
+        return ",".join(v.strip() for v in value)
+    return value
+
+
+def _lazy_load_csv_rows(path, text_columns, metadata_columns, start=0):
+    # Row by row with the csv module, for files Arrow cannot parse (ragged rows, newlines in values).
+    with open(path, newline="", encoding="utf-8") as f:
+        for row, record in enumerate(csv.DictReader(f)):
+            if row < start:
+                continue
+            columns = text_columns or [name for name in record if name not in metadata_columns]
+            text = "\n".join(f"{_cell(name)}: {_cell(record.get(name))}" for name in columns)
+            metadata = {"source": path, "row": row}
+            for name in metadata_columns:
+                if record.get(name) is not None:
+                    metadata[name] = record[name]
+            yield Document(page_content=text, metadata=metadata)
+
+
+# One Document per row, with the same text and source/row metadata as CSVLoader.
+# Rows are rendered from `text_columns` (every column not in `metadata_columns` by default),
+# and the values of `metadata_columns` are kept as metadata, e.g. to filter on.
+def lazy_load_table(path, text_columns=None, metadata_columns=(), batch_size=TABLE_BATCH_ROWS):
+    import pyarrow as pa
+
+    path = str(path)
+    if os.path.getsize(path) == 0:
+        return
+    row = 0
+    try:
+        for batch in iter_record_batches(path, batch_size):
+            columns = text_columns or [name for name in batch.schema.names if name not in metadata_columns]
+            metadata_values = {name: batch.column(name).to_pylist() for name in metadata_columns}
+            for n, text in enumerate(render_rows(batch, columns)):
+                metadata = {"source": path, "row": row + n}
+                for name, values in metadata_values.items():
+                    if values[n] is not None:
+                        metadata[name] = values[n]
+                yield Document(page_content=text, metadata=metadata)
+            row += batch.num_rows
+    except pa.ArrowInvalid as exc:
+        if path.endswith(".parquet"):
+            raise
+        # Every row before the failing block was already yielded; carry on from there.
+        logging.warning(f"Reading {path} row by row from row {row}: {exc}")
+        yield from _lazy_load_csv_rows(path, text_columns, metadata_columns, start=row)
+
+
+def list_table_files(data_dir="./data"):
+    for pattern in ('**/*.csv', '**/*.parquet'):
+        for path in Path(data_dir).glob(pattern):
+            yield str(path)
+
+
+def lazy_load_csv_files(data_dir="./data", text_columns=None, metadata_columns=()):
+    for path in list_table_files(data_dir):
+        print(f"Loading {path}")
+        yield from lazy_load_table(path, text_columns, metadata_columns)
+
+
+def load_csv_files(data_dir="./data", text_columns=None, metadata_columns=()):
+    return list(lazy_load_csv_files(data_dir, text_columns, metadata_columns))
+
+
+PDF_CACHE_DIR = os.path.join("store", "pdf_text")
+PDF_PAGES_PER_TASK = 8
+
+_worker_reader = None
+
+
+def _init_pdf_worker(data):
+    # Each worker process parses the PDF once and then extracts the page ranges it is given.
+    from pypdf import PdfReader
+
+    global _worker_reader
+    _worker_reader = PdfReader(io.BytesIO(data))
+
+
+def _extract_pages(start, stop):
+    return [_worker_reader.pages[num].extract_text() for num in range(start, stop)]
+
+
+class PageTextCache:
+    """Extracted page text on disk, keyed by (file hash, page number)."""
+
+    def __init__(self, file_hash, cache_dir=PDF_CACHE_DIR):
+        self.dir = os.path.join(cache_dir, file_hash)
+
+    def page_count(self):
+        try:
+            with open(os.path.join(self.dir, "pages")) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def set_page_count(self, count):
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, "pages"), "w") as f:
+            f.write(str(count))
+
+    def get(self, num):
+        try:
+            with open(os.path.join(self.dir, f"{num}.txt"), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, num, text):
+        os.makedirs(self.dir, exist_ok=True)
+        path = os.path.join(self.dir, f"{num}.txt")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+
+def iter_pdf_pages(data, workers=1, pages_per_task=PDF_PAGES_PER_TASK):
+    """Yield the text of each page of the PDF in `data`, in page order.
+
+    Pages extracted before are read from the cache. With workers > 1 the remaining page
+    ranges are extracted in a process pool, and pages are yielded as soon as their range
+    and every range before it have finished.
+    """
+    from pypdf import PdfReader
+
+    cache = PageTextCache(hashlib.sha256(data).hexdigest())
+    n_pages = cache.page_count()
+    reader = None
+    if n_pages is None:
+        reader = PdfReader(io.BytesIO(data))
+        n_pages = len(reader.pages)
+        cache.set_page_count(n_pages)
+
+    ranges = [(start, min(start + pages_per_task, n_pages)) for start in range(0, n_pages, pages_per_task)]
+    cached = {}
+    todo = []
+    for start, stop in ranges:
+        texts = [cache.get(num) for num in range(start, stop)]
+        if None in texts:
+            todo.append((start, stop))
+        else:
+            cached[start] = texts
+
+    executor = None
+    futures = {}
+    if workers > 1 and len(todo) > 1:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(todo)),
+                                       initializer=_init_pdf_worker, initargs=(data,))
+        futures = {start: executor.submit(_extract_pages, start, stop) for start, stop in todo}
+    try:
+        for start, stop in ranges:
+            if start in cached:
+                texts = cached[start]
+            elif start in futures:
+                texts = futures[start].result()
+            else:
+                if reader is None:
+                    reader = PdfReader(io.BytesIO(data))
+                texts = [reader.pages[num].extract_text() for num in range(start, stop)]
+            for num, text in enumerate(texts, start=start):
+                if start not in cached:
+                    cache.put(num, text)
+                yield text
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
 
 
 # Use with result of file_to_summarize = st.file_uploader("Choose a file") or a string.
 # or a file like object.
-def get_document_text(uploaded_file, title=None):
-    docs = []
+def iter_document_text(uploaded_file, title=None, workers=1):
     fname = uploaded_file.name
     if not title:
         title = os.path.basename(fname)
     if fname.lower().endswith('pdf'):
-        pdf_reader = PdfReader(uploaded_file)
-        for num, page in enumerate(pdf_reader.pages):
-            page = page.extract_text()
-            doc = Document(page_content=page, metadata={'title': title, 'page': (num + 1)})
-            docs.append(doc)
+        for num, page in enumerate(iter_pdf_pages(uploaded_file.read(), workers=workers)):
+            yield Document(page_content=page, metadata={'source': fname, 'title': title, 'page': (num + 1),
+                                                         'doc_type': 'pdf'})
 
     else:
         # assume text
         doc_text = uploaded_file.read().decode()
-        docs.append(doc_text)
+        yield doc_text
+
 
-    return docs
+def get_document_text(uploaded_file, title=None, workers=1):
+    return list(iter_document_text(uploaded_file, title, workers))
 
 
 if __name__ == "__main__":
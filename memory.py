@@ -1,21 +1,149 @@
+import logging
 import os
-from typing import List, Iterable, Any
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import List, Iterable, Any, Sequence
 
 from dotenv import load_dotenv
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableBranch, RunnableParallel
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
-from basic_chain import get_model
-from rag_chain import make_rag_chain
+from history_store import SESSION_TTL, InMemoryHistoryStore, LRUCache
+from rag_chain import inline_lambda, make_rag_chain, retrieval
+from tokens import count_tokens
 
 
-def create_memory_chain(llm, base_chain, chat_memory):
+# Words that usually point back at something said earlier in the conversation.
+ANAPHORA_RE = re.compile(
+    r"\b(it|its|they|them|their|theirs|this|that|these|those|he|him|his|she|her|hers|"
+    r"above|previous|former|latter|same|again|also|else|another|other|others|there|then)\b",
+    re.IGNORECASE)
+MIN_STANDALONE_WORDS = 4
+
+
+def needs_rewrite(inputs):
+    """Cheap check for whether the question depends on the chat history."""
+    if not inputs.get("chat_history"):
+        return False
+    question = inputs["question"]
+    return len(question.split()) < MIN_STANDALONE_WORDS or bool(ANAPHORA_RE.search(question))
+
+
+def _normalize(text):
+    return " ".join(text.lower().split()).rstrip("?.! ")
+
+
+def use_speculative_docs(outputs):
+    # If the rewrite left the question alone, the retrieval already run on it is the right one.
+    if _normalize(outputs["rewritten"]) == _normalize(outputs["question"]):
+        return {"question": outputs["question"], "docs": outputs["docs"]}
+    return outputs["rewritten"]
+
+
+def keep_filter(outputs):
+    # The rewrite yields just a question; a metadata filter in the input has to ride along with it.
+    question, filter = outputs["question"], outputs["filter"]
+    if not filter:
+        return question
+    if isinstance(question, dict):
+        return {**question, "filter": filter}
+    return {"question": question, "filter": filter}
+
+
+MAX_HISTORY_TOKENS = 1000
+MAX_SUMMARY_WORDS = 150
+
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarize")
+
+
+def count_message_tokens(message):
+    # A few tokens of per-message overhead on top of the content, as chat formats add.
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return count_tokens(content) + 4
+
+
+class WindowedChatMessageHistory(BaseChatMessageHistory):
+    """Shows the most recent messages that fit in `max_tokens`, plus a summary of older ones.
+
+    Every message is still written to the wrapped `history`. Messages that slide out of the
+    window are folded into a running summary by `llm` on a background thread, so the prompt
+    size stays roughly constant however long the conversation runs.
+    """
+
+    def __init__(self, history, llm=None, max_tokens=MAX_HISTORY_TOKENS):
+        self.history = history
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.summary = ""
+        self.summarized = 0
+        self.lock = threading.Lock()
+        self.future = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        messages = self.history.messages
+        start = len(messages)
+        budget = self.max_tokens
+        while start > 0:
+            tokens = count_message_tokens(messages[start - 1])
+            if tokens > budget:
+                break
+            budget -= tokens
+            start -= 1
+
+        with self.lock:
+            if len(messages) < self.summarized:
+                # The history shrank underneath us (e.g. it was cleared elsewhere); start over.
+                self.summary, self.summarized = "", 0
+            # Never repeat messages the summary already covers.
+            start = max(start, self.summarized)
+            # One summarization at a time per session; whatever it misses is picked up next turn.
+            if self.llm and start > self.summarized and (self.future is None or self.future.done()):
+                self.future = _summarizer.submit(self._summarize, messages[self.summarized:start], start)
+            summary = self.summary
+
+        window = messages[start:]
+        if summary:
+            return [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] + window
+        return window
+
+    def _summarize(self, messages, upto):
+        prompt = (f"Progressively summarize the conversation, adding onto the previous summary "
+                  f"in at most {MAX_SUMMARY_WORDS} words.\n\n"
+                  f"Previous summary:\n{self.summary or '(none)'}\n\n"
+                  f"New lines of conversation:\n{get_buffer_string(messages)}\n\nNew summary:")
+        try:
+            summary = self.llm.invoke(prompt)
+        except Exception as exc:
+            logging.warning(f"Could not summarize chat history: {exc}")
+            return
+        with self.lock:
+            self.summary = getattr(summary, "content", summary)
+            self.summarized = upto
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.history.add_messages(messages)
+
+    def clear(self) -> None:
+        self.history.clear()
+        with self.lock:
+            self.summary, self.summarized = "", 0
+
+
+# `filter` is the static metadata filter the base chain retrieves with (make_rag_chain's `filter=`);
+# speculative retrieval must apply it too, since its docs are used in place of the base chain's.
+def create_memory_chain(llm, base_chain, chat_memory=None, speculative_retriever=None,
+                        max_history_tokens=MAX_HISTORY_TOKENS, history_store=None, filter=None):
     contextualize_q_system_prompt = """Given a chat history and the latest user question \
         which might reference context in the chat history, formulate a standalone question \
         which can be understood without the chat history. Do NOT answer the question, \
@@ -29,10 +157,36 @@ def create_memory_chain(llm, base_chain, chat_memory):
         ]
     )
 
-    runnable = contextualize_q_prompt | llm | base_chain
+    rewrite = contextualize_q_prompt | llm | StrOutputParser()
+    if speculative_retriever:
+        # Retrieve on the raw question while the rewrite is in flight.
+        rewrite = RunnableParallel(
+            question=inline_lambda(itemgetter("question")),
+            rewritten=rewrite,
+            docs=retrieval(speculative_retriever, filter),
+        ) | inline_lambda(use_speculative_docs)
+
+    # Only pay for the rewrite LLM call when the question looks like it needs the history.
+    contextualize = RunnableBranch(
+        (inline_lambda(needs_rewrite), rewrite),
+        inline_lambda(itemgetter("question")),
+    ).with_config(run_name="contextualize_question")
+    runnable = RunnableParallel(
+        question=contextualize,
+        filter=inline_lambda(lambda inputs: inputs.get("filter")),
+    ) | inline_lambda(keep_filter) | base_chain
+
+    # A fixed chat_memory is used for every session (e.g. Streamlit's per-browser history);
+    # otherwise each session_id gets its own history from the store.
+    if chat_memory is None and history_store is None:
+        history_store = InMemoryHistoryStore()
+    windows = LRUCache(ttl=SESSION_TTL)
 
     def get_session_history(session_id: str) -> BaseChatMessageHistory:
-        return chat_memory
+        def create():
+            history = chat_memory if chat_memory is not None else history_store.get(session_id)
+            return WindowedChatMessageHistory(history, llm, max_history_tokens)
+        return windows.get_or_create(session_id, create)
 
     with_message_history = RunnableWithMessageHistory(
         runnable,
@@ -63,6 +217,8 @@ class SimpleTextRetriever(BaseRetriever):
 
 
 def main():
+    from basic_chain import get_model
+
     load_dotenv()
     model = get_model("llama-3.1-8b-instant")
     chat_memory = ChatMessageHistory()
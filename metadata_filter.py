@@ -0,0 +1,167 @@
+import json
+import os
+
+import numpy as np
+
+from document_log import save_array
+
+# Filters use Chroma's `where` syntax, so the same filter works on every store:
+#   {"source": "data/meal_plan.txt"}, {"page": {"$gte": 3}}, {"doc_type": {"$in": ["csv", "pdf"]}},
+#   {"$and": [...]}, {"$or": [...]}
+OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+# Unique per chunk, so indexing them would cost a value per chunk and never narrow a search.
+UNINDEXED_FIELDS = ("chunk_id", "start_index")
+MISSING = -1
+
+
+def combine_filters(*filters):
+    """One filter matching what all of `filters` match; None if none are given."""
+    filters = [f for f in filters if f]
+    if not filters:
+        return None
+    return filters[0] if len(filters) == 1 else {"$and": filters}
+
+
+def _conditions(condition):
+    if not isinstance(condition, dict):
+        return {"$eq": condition}
+    for op in condition:
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown filter operator {op}, expected one of {OPERATORS}")
+    return condition
+
+
+def _compare(value, op, operand):
+    try:
+        if op == "$eq":
+            return value == operand
+        if op == "$ne":
+            return value != operand
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+        if op == "$in":
+            return value in operand
+        return value not in operand
+    except TypeError:
+        return False
+
+
+def matches(metadata, where):
+    """Whether a document with `metadata` passes the filter `where`."""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, w) for w in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, w) for w in condition):
+                return False
+        elif key not in metadata:
+            return False
+        elif not all(_compare(metadata[key], op, operand) for op, operand in _conditions(condition).items()):
+            return False
+    return True
+
+
+class MetadataIndex:
+    """Columnar index of chunk metadata, for turning a filter into a mask over slots.
+
+    Each field keeps its distinct values and an int32 column with the value id of every slot,
+    so a filter is evaluated once per distinct value and then applied to all slots with numpy,
+    without reading any documents.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.values = {}
+        self.columns = {}
+
+    def add(self, metadatas):
+        metadatas = list(metadatas)
+        fields = {key for metadata in metadatas for key, value in metadata.items()
+                  if key not in UNINDEXED_FIELDS and isinstance(value, (str, int, float, bool))}
+        for field in fields:
+            values = self.values.setdefault(field, {})
+            column = np.full(len(metadatas), MISSING, dtype=np.int32)
+            for n, metadata in enumerate(metadatas):
+                value = metadata.get(field)
+                if isinstance(value, (str, int, float, bool)):
+                    column[n] = values.setdefault(value, len(values))
+            self.columns[field] = np.concatenate([self.column(field), column])
+        self.size += len(metadatas)
+
+    def column(self, field):
+        # Fields a batch did not have are padded out as missing.
+        column = self.columns.get(field, np.zeros(0, dtype=np.int32))
+        if len(column) < self.size:
+            column = np.concatenate([column, np.full(self.size - len(column), MISSING, dtype=np.int32)])
+        return column
+
+    def _field_mask(self, field, condition):
+        values = self.values.get(field, {})
+        selected = None
+        for op, operand in _conditions(condition).items():
+            if op in ("$eq", "$in"):
+                wanted = [operand] if op == "$eq" else operand
+                ids = {values[value] for value in wanted if value in values}
+            else:
+                ids = {value_id for value, value_id in values.items() if _compare(value, op, operand)}
+            selected = ids if selected is None else selected & ids
+        return np.isin(self.column(field), np.fromiter(selected, dtype=np.int32, count=len(selected)))
+
+    def mask(self, where):
+        """Boolean array over slots that is True where the metadata passes `where`."""
+        mask = np.ones(self.size, dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for w in condition:
+                    mask &= self.mask(w)
+            elif key == "$or":
+                any_mask = np.zeros(self.size, dtype=bool)
+                for w in condition:
+                    any_mask |= self.mask(w)
+                mask &= any_mask
+            else:
+                mask &= self._field_mask(key, condition)
+        return mask
+
+    def take(self, slots):
+        """Index of just `slots`, renumbered from 0 in the given order."""
+        index = MetadataIndex()
+        index.size = len(slots)
+        index.values = self.values
+        index.columns = {field: np.asarray(self.column(field))[slots] for field in self.columns}
+        return index
+
+    def save(self, directory, prefix):
+        fields = sorted(self.columns)
+        for n, field in enumerate(fields):
+            save_array(os.path.join(directory, f"{prefix}_{n}.npy"), self.column(field))
+        path = os.path.join(directory, f"{prefix}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"size": self.size, "fields": [[field, list(self.values[field])] for field in fields]}, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, directory, prefix, size):
+        """The saved index if it covers exactly `size` slots, otherwise None."""
+        index = cls()
+        try:
+            with open(os.path.join(directory, f"{prefix}.json")) as f:
+                meta = json.load(f)
+            if meta["size"] != size:
+                return None
+            for n, (field, values) in enumerate(meta["fields"]):
+                index.values[field] = {value: value_id for value_id, value in enumerate(values)}
+                index.columns[field] = np.load(os.path.join(directory, f"{prefix}_{n}.npy"), mmap_mode="r")
+                if len(index.columns[field]) != size:
+                    return None
+        except (OSError, ValueError, KeyError):
+            return None
+        index.size = size
+        return index
@@ -0,0 +1,237 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from tokens import count_tokens
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Runs whose time is reported as a stage of their own, by run name.
+STAGES = ("contextualize_question", "semantic_cache")
+
+HELP = {
+    "rag_stage_latency_seconds": "Time spent in each stage of a chat turn.",
+    "rag_time_to_first_token_seconds": "Time from the start of a chat turn to the first answer token.",
+    "rag_errors_total": "Stages that raised an error.",
+    "rag_llm_tokens_total": "Tokens sent to and generated by the chat model.",
+    "rag_retrieved_documents_total": "Documents returned by each retriever.",
+    "rag_cache_requests_total": "Cache lookups by cache and result.",
+}
+
+logger = logging.getLogger("rag.metrics")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class MetricsRegistry:
+    """In-process counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("rag_stage_latency_seconds", time.perf_counter() - start, stage=stage)
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value["buckets"])))
+                                for key, value in self.histograms.items())
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Times each stage of a chat turn and records it in `registry`.
+
+    Named stages (see STAGES), every retriever and every chat model call are timed, along
+    with the whole turn and the time to the first answer token. Token usage and retrieved
+    document counts are counted too, and one JSON log line summarizing the turn is written
+    to the "rag.metrics" logger when it finishes.
+    """
+
+    # Cheap enough to run on the caller's thread, even inside async runs.
+    run_inline = True
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self.runs = {}
+        self.turns = {}
+        self.lock = threading.Lock()
+
+    def _start(self, run_id, parent_run_id, stage, metadata=None):
+        now = time.perf_counter()
+        with self.lock:
+            parent = self.runs.get(parent_run_id)
+            if parent is None:
+                root, contextualizing = run_id, False
+                self.turns[run_id] = {"start": now, "first_token": None, "stages": {}, "retrieved": {},
+                                      "tokens": {"prompt": 0, "completion": 0},
+                                      "session_id": (metadata or {}).get("session_id")}
+            else:
+                root, contextualizing = parent["root"], parent["contextualizing"]
+            contextualizing = contextualizing or stage == "contextualize_question"
+            self.runs[run_id] = {"root": root, "stage": stage, "start": now, "contextualizing": contextualizing}
+
+    def _end(self, run_id, error=None):
+        now = time.perf_counter()
+        with self.lock:
+            run = self.runs.pop(run_id, None)
+            if run is None:
+                return None, None
+            turn = self.turns.pop(run_id, None) if run["root"] == run_id else self.turns.get(run["root"])
+            if run["stage"] and turn is not None:
+                turn["stages"][run["stage"]] = turn["stages"].get(run["stage"], 0.0) + now - run["start"]
+        if run["stage"]:
+            self.registry.observe("rag_stage_latency_seconds", now - run["start"], stage=run["stage"])
+            if error is not None:
+                self.registry.inc("rag_errors_total", stage=run["stage"])
+        if run["root"] == run_id and turn is not None:
+            self._log_turn(turn, now, error)
+        return run, turn
+
+    def _log_turn(self, turn, now, error):
+        record = {
+            "event": "rag_turn",
+            "session_id": turn["session_id"],
+            "latency_ms": round((now - turn["start"]) * 1000, 2),
+            "ttft_ms": round((turn["first_token"] - turn["start"]) * 1000, 2) if turn["first_token"] else None,
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in turn["stages"].items()},
+            "retrieved": turn["retrieved"],
+            "tokens": turn["tokens"],
+        }
+        if error is not None:
+            record["error"] = repr(error)
+        logger.info(json.dumps(record))
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        if parent_run_id is None:
+            stage = "chain"
+        else:
+            stage = name if name in STAGES else None
+        self._start(run_id, parent_run_id, stage, metadata)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "retriever"
+        self._start(run_id, parent_run_id, f"retriever:{name}", metadata)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        run, turn = self._end(run_id)
+        if run is None:
+            return
+        name = run["stage"].split(":", 1)[1]
+        self.registry.inc("rag_retrieved_documents_total", len(documents), retriever=name)
+        if turn is not None:
+            with self.lock:
+                turn["retrieved"][name] = turn["retrieved"].get(name, 0) + len(documents)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def _llm_start(self, run_id, parent_run_id, metadata):
+        parent = self.runs.get(parent_run_id)
+        stage = "llm:contextualize" if parent and parent["contextualizing"] else "llm:generate"
+        self._start(run_id, parent_run_id, stage, metadata)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._llm_start(run_id, parent_run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._llm_start(run_id, parent_run_id, metadata)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        run = self.runs.get(run_id)
+        if run is None or run["contextualizing"]:
+            return
+        turn = self.turns.get(run["root"])
+        if turn is not None and turn["first_token"] is None:
+            turn["first_token"] = time.perf_counter()
+            self.registry.observe("rag_time_to_first_token_seconds", turn["first_token"] - turn["start"])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run, turn = self._end(run_id)
+        if run is None:
+            return
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                else:
+                    completion_tokens += count_tokens(generation.text)
+        self.registry.inc("rag_llm_tokens_total", prompt_tokens, type="prompt")
+        self.registry.inc("rag_llm_tokens_total", completion_tokens, type="completion")
+        if turn is not None:
+            with self.lock:
+                turn["tokens"]["prompt"] += prompt_tokens
+                turn["tokens"]["completion"] += completion_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import httpx
+
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+_instances = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def config_key(kind, *args, **kwargs):
+    # kwargs can hold API keys, so they are hashed to keep them out of logs.
+    options = hashlib.sha256(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    return f"{kind}:{':'.join(map(str, args))}:{options}"
+
+
+def get_or_create(key, factory):
+    """The object registered under `key`, created by `factory` on first use and then shared."""
+    with _lock:
+        if key in _instances:
+            return _instances[key]
+        lock = _locks.setdefault(key, threading.Lock())
+    # Creation can take seconds (model downloads), so only callers wanting the same key wait for it.
+    with lock:
+        if key not in _instances:
+            start = time.monotonic()
+            instance = factory()
+            logging.info(f"Loaded {key} in {time.monotonic() - start:.1f}s")
+            with _lock:
+                _instances[key] = instance
+        return _instances[key]
+
+
+def get_http_client():
+    """One pooled, keep-alive HTTP client shared by every model client in the process."""
+    return get_or_create("http_client", lambda: httpx.Client(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT))
+
+
+def get_async_http_client():
+    """The async counterpart of get_http_client, for ainvoke/astream (e.g. the API server's streaming).
+
+    Its connections belong to the event loop that opens them, so it serves one long-lived loop
+    per process, as in a server worker.
+    """
+    return get_or_create("async_http_client",
+                         lambda: httpx.AsyncClient(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT))
+
+
+def _create_embeddings(provider, model_name, **kwargs):
+    if provider == "huggingface":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name, **kwargs)
+    if provider == "huggingface-bge":
+        from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+        return HuggingFaceBgeEmbeddings(model_name=model_name, **kwargs)
+    if provider == "huggingface-endpoint":
+        from langchain_huggingface import HuggingFaceEndpointEmbeddings
+        return HuggingFaceEndpointEmbeddings(model=model_name, **kwargs)
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model_name, http_client=get_http_client(),
+                                http_async_client=get_async_http_client(), **kwargs)
+    raise ValueError(f"Unknown embeddings provider: {provider}")
+
+
+def get_embeddings(model_name=DEFAULT_EMBEDDING_MODEL, provider="huggingface", **kwargs):
+    return get_or_create(config_key("embeddings", provider, model_name, **kwargs),
+                         lambda: _create_embeddings(provider, model_name, **kwargs))
+
+
+def get_chat_model(repo_id, factory, **kwargs):
+    return get_or_create(config_key("chat", repo_id, **kwargs), lambda: factory(repo_id, **kwargs))
+
+
+def warm_up(embeddings=(), chat_models=()):
+    """Load models ahead of the first request, e.g. at server startup."""
+    from basic_chain import get_model
+
+    for embedding in embeddings:
+        # The first call also initializes the tokenizer and runtime, not just the weights.
+        embedding.embed_query("warm up")
+    for repo_id in chat_models:
+        get_model(repo_id)
@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+
+from langchain_core.load import dumps, loads
+from langchain_core.prompts import ChatPromptTemplate
+
+PROMPT_CACHE_DIR = os.path.join("store", "prompts")
+RAG_PROMPT = "rlm/rag-prompt"
+# Set to 1 to re-download prompts from the LangChain hub instead of using the local copies.
+REFRESH_ENV = "PROMPT_REFRESH"
+
+# Offline copies of hub prompts, with the commit each was taken from; that commit is the pinned version.
+BUNDLED_PROMPTS = {
+    "rlm/rag-prompt": ("50442af1", [
+        ("human", "You are an assistant for question-answering tasks. Use the following pieces of retrieved "
+                  "context to answer the question. If you don't know the answer, just say that you don't know. "
+                  "Use three sentences maximum and keep the answer concise.\n"
+                  "Question: {question} \nContext: {context} \nAnswer:"),
+    ]),
+}
+
+_prompts = {}
+_lock = threading.Lock()
+
+
+def cache_path(handle, commit):
+    return os.path.join(PROMPT_CACHE_DIR, f"{handle.replace('/', '__')}@{commit}.json")
+
+
+def _load_cached(handle, commit):
+    try:
+        with open(cache_path(handle, commit)) as f:
+            return loads(f.read(), allowed_objects="core")
+    except OSError:
+        return None
+    except Exception as exc:
+        logging.warning(f"Ignoring unreadable cached prompt {handle}:{commit}: {exc}")
+        return None
+
+
+def _save_cached(handle, commit, prompt):
+    path = cache_path(handle, commit)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        f.write(dumps(prompt))
+    os.replace(path + ".tmp", path)
+
+
+def _pull(handle, commit):
+    from langchain import hub
+
+    prompt = hub.pull(f"{handle}:{commit}" if commit else handle)
+    commit = commit or (prompt.metadata or {}).get("lc_hub_commit_hash", "latest")[:8]
+    _save_cached(handle, commit, prompt)
+    return prompt
+
+
+def get_prompt(name=RAG_PROMPT, refresh=None):
+    """Prompt `name` ("owner/repo" or "owner/repo:commit") from memory, the disk cache or the bundled copy.
+
+    Without a commit, the bundled prompt's commit is used. Nothing is fetched from the hub unless
+    `refresh` is true (or PROMPT_REFRESH=1 is set), in which case the fetched copy is also cached on disk.
+    """
+    handle, _, commit = name.partition(":")
+    bundled_commit, messages = BUNDLED_PROMPTS.get(handle, (None, None))
+    commit = commit or bundled_commit
+    if refresh is None:
+        refresh = os.environ.get(REFRESH_ENV) == "1"
+    key = (handle, commit)
+    if not refresh and key in _prompts:
+        return _prompts[key]
+
+    with _lock:
+        if refresh:
+            prompt = _pull(handle, commit)
+        else:
+            prompt = _load_cached(handle, commit) if commit else None
+            if prompt is None and commit == bundled_commit and messages:
+                prompt = ChatPromptTemplate.from_messages(messages)
+        if prompt is None:
+            raise ValueError(f"Prompt {name} is neither bundled nor cached; fetch it once with refresh=True")
+        _prompts[key] = prompt
+    return prompt
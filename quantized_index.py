@@ -0,0 +1,247 @@
+import os
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from document_log import save_array
+from slot_index import SlotIndex
+
+MODES = ("int8", "binary")
+# First-pass candidates per requested result; binary codes are coarser, so they need more.
+OVERSAMPLE = {"int8": 4, "binary": 16}
+SCAN_BLOCK = 65536
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def quantize(vectors, mode):
+    """Codes (and per-vector scales for int8) for unit-length float32 `vectors`."""
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return np.packbits(vectors > 0, axis=1), None
+
+
+class QuantizedVectorStore(SlotIndex, VectorStore):
+    """Vector store that searches int8 or binary codes and rescores with exact vectors.
+
+    Codes take 1/4 (int8, plus a 4-byte scale) or 1/32 (binary) of the float32 size and are
+    held in RAM, or memory-mapped with `mmap=True`. The full-precision unit vectors live in an
+    append-only file on disk; a search scans the codes for `k * oversample` candidates and
+    reads only those rows back to rank them by exact cosine similarity. A metadata `filter`
+    restricts both passes to the matching slots, so scoped queries scan only those codes.
+    Documents are kept in a DocumentLog; call save() to persist the codes after adding.
+    Deletes are tombstones until they make up COMPACT_DEAD_FRACTION of the slots, when save()
+    drops them from every file.
+    """
+
+    def __init__(self, directory, embedding: Embeddings, mode="int8", mmap=False, oversample=None):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.embedding = embedding
+        self.mode = mode
+        self.oversample = oversample or OVERSAMPLE[mode]
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self._vectors = None
+        self.dim = None
+        self.codes = None
+        self.scales = np.zeros(0, dtype=np.float32)
+
+        meta = self._open_slots(directory, "quantized")
+        codes = None
+        if meta is not None:
+            if meta["mode"] != mode:
+                raise ValueError(f"{directory} holds a {meta['mode']} index, not {mode}")
+            mmap_mode = "r" if mmap else None
+            codes = np.load(self._path("codes"), mmap_mode=mmap_mode)
+        # Codes that disagree with quantized.json mean an interrupted save; start empty.
+        if self._load_slots(meta, [codes]):
+            self.dim = meta["dim"]
+            self.codes = codes
+            if mode == "int8":
+                self.scales = np.load(self._path("scales"), mmap_mode=mmap_mode)
+        # Vectors written after the last save have no codes; drop them.
+        if os.path.exists(self.vectors_path):
+            os.truncate(self.vectors_path, len(self.slot_ids) * (self.dim or 0) * 4)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    @property
+    def vectors(self):
+        # Full-precision vectors, memory-mapped; only rows that are rescored are read from disk.
+        if self._vectors is None or len(self._vectors) != len(self.slot_ids):
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                      shape=(len(self.slot_ids), self.dim))
+        return self._vectors
+
+    def memory_bytes(self):
+        """Bytes taken by the codes and scales; float32 vectors would take 4 * dim per chunk."""
+        return self.codes.nbytes + self.scales.nbytes if self.codes is not None else 0
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        new = [n for n, doc_id in enumerate(ids) if doc_id not in self.id_to_slot]
+        if not new:
+            return ids
+        vectors = normalize(self.embedding.embed_documents([texts[n] for n in new]))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        codes, scales = quantize(vectors, self.mode)
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        self._add_slots([Document(page_content=texts[n], metadata=metadatas[n]) for n in new], [ids[n] for n in new])
+        self.codes = codes if self.codes is None else np.concatenate([self.codes, codes])
+        if scales is not None:
+            self.scales = np.concatenate([self.scales, scales])
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        self._delete_slots(ids or [])
+        return True
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=0, **kwargs):
+        """Chroma-style get, so this store can stand in for Chroma in sync_documents and the filters."""
+        include = include if include is not None else ["documents", "metadatas"]
+        if ids is None:
+            found = self.ids(where)[offset:None if limit is None else offset + limit]
+        else:
+            found = [doc_id for doc_id in ids if doc_id in self.id_to_slot]
+            if where:
+                mask = self.metadata.mask(where)
+                found = [doc_id for doc_id in found if mask[self.id_to_slot[doc_id]]]
+        slots = [self.id_to_slot[doc_id] for doc_id in found]
+        result = {"ids": found}
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(self.vectors[slots]) if slots else np.zeros((0, self.dim or 0))
+        if "documents" in include or "metadatas" in include:
+            docs = self.docs.get(slots)
+            result["documents"] = [doc.page_content for doc in docs]
+            result["metadatas"] = [doc.metadata for doc in docs]
+        return result
+
+    def get_by_ids(self, ids):
+        return self.docs.get([self.id_to_slot[doc_id] for doc_id in ids if doc_id in self.id_to_slot])
+
+    def _first_pass(self, query, n_candidates, slots=None):
+        # Scores the codes of `slots` (all slots if None) and returns the best `n_candidates` slots.
+        if self.mode == "int8":
+            query_code = query
+        else:
+            query_code = np.packbits(query > 0)
+        n_slots = len(self.slot_ids) if slots is None else len(slots)
+        scores = np.empty(n_slots, dtype=np.float32)
+        for start in range(0, n_slots, SCAN_BLOCK):
+            rows = slice(start, start + SCAN_BLOCK) if slots is None else slots[start:start + SCAN_BLOCK]
+            block = self.codes[rows]
+            if self.mode == "int8":
+                scores[start:start + len(block)] = (block.astype(np.float32) @ query_code) * self.scales[rows]
+            else:
+                scores[start:start + len(block)] = -POPCOUNT[block ^ query_code].sum(axis=1, dtype=np.int32)
+        if slots is None:
+            scores[~self.alive] = -np.inf
+            slots = np.arange(n_slots)
+        n_candidates = min(n_candidates, n_slots)
+        return slots[np.argpartition(-scores, n_candidates - 1)[:n_candidates]]
+
+    def search_slots(self, query_vector, k=4, exact=False, filter=None):
+        """Slots and exact cosine similarities of the `k` best matches, best first.
+
+        With a `filter` (Chroma `where` syntax), only slots whose metadata passes it are scored.
+        """
+        allowed = np.flatnonzero(self.alive & self.metadata.mask(filter)) if filter else None
+        if not self.id_to_slot or (allowed is not None and not len(allowed)):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = normalize(query_vector)
+        if exact:
+            candidates = np.flatnonzero(self.alive) if allowed is None else allowed
+        else:
+            n_candidates = min(k * self.oversample, len(self.id_to_slot))
+            candidates = np.sort(self._first_pass(query, n_candidates, allowed))
+        similarities = np.asarray(self.vectors[candidates]) @ query
+        top = np.argsort(-similarities)[:k]
+        return candidates[top], similarities[top]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        slots, similarities = self.search_slots(embedding, k, filter=filter)
+        return list(zip(self.docs.get(slots.tolist()), similarities.tolist()))
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        return lambda similarity: similarity
+
+    def recall(self, k=10, n_queries=100, seed=0):
+        """Mean recall@k of the quantized search against exact search, using stored vectors as queries."""
+        alive = np.flatnonzero(self.alive)
+        if not len(alive):
+            return None
+        queries = np.random.default_rng(seed).choice(alive, size=min(n_queries, len(alive)), replace=False)
+        recalls = []
+        for slot in queries:
+            query = np.asarray(self.vectors[slot])
+            approximate, _ = self.search_slots(query, k)
+            exact, _ = self.search_slots(query, k, exact=True)
+            recalls.append(len(set(approximate.tolist()) & set(exact.tolist())) / len(exact))
+        return float(np.mean(recalls))
+
+    def _compact(self):
+        # Copied a block at a time, so this never holds all the full-precision vectors in memory.
+        live = np.flatnonzero(self.alive)
+        with open(self.vectors_path + ".tmp", "wb") as f:
+            for start in range(0, len(live), SCAN_BLOCK):
+                f.write(np.asarray(self.vectors[live[start:start + SCAN_BLOCK]]).tobytes())
+        self._vectors = None
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        self._compact_slots()
+        self.codes = np.asarray(self.codes[live])
+        if self.mode == "int8":
+            self.scales = np.asarray(self.scales[live])
+
+    def save(self):
+        """Persist codes and tombstones; a no-op if nothing changed since the last save."""
+        if self.codes is None or not self.dirty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self._needs_compaction():
+            # quantized.json is written last; until then the files disagree with it, which
+            # __init__ treats as an interrupted save.
+            self._compact()
+        else:
+            self.docs.save()
+        save_array(self._path("codes"), np.asarray(self.codes))
+        if self.mode == "int8":
+            save_array(self._path("scales"), np.asarray(self.scales))
+        self._save_slots({"mode": self.mode, "dim": self.dim})
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, directory=None, mode="int8", **kwargs: Any):
+        store = cls(directory, embedding, mode=mode, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        store.save()
+        return store
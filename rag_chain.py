@@ -1,20 +1,19 @@
 import os
+from operator import itemgetter
 
 from dotenv import load_dotenv
-from langchain import hub
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnableBranch, RunnableLambda
 from langchain_core.messages.base import BaseMessage
 
-from basic_chain import basic_chain, get_model
-from remote_loader import get_wiki_docs
-from splitter import split_documents
-from vector_store import create_vector_db
+from context_assembler import MAX_CONTEXT_TOKENS, assemble_context
+from metadata_filter import combine_filters
+from prompts import RAG_PROMPT, get_prompt
 
 
-def find_similar(vs, query):
-    docs = vs.similarity_search(query)
+def find_similar(vs, query, filter=None, k=4):
+    docs = vs.similarity_search(query, k=k, filter=filter)
     return docs
 
 
@@ -35,25 +34,73 @@ def get_question(input):
         raise Exception("string or dict with 'question' key expected as RAG chain input.")
 
 
-def make_rag_chain(model, retriever, rag_prompt = None):
-    # We will use a prompt template from langchain hub.
+def inline_lambda(func):
+    """RunnableLambda for a cheap function that also runs inline on the async path, not in a thread."""
+    async def afunc(input):
+        return func(input)
+    return RunnableLambda(func, afunc=afunc)
+
+
+def has_docs(input):
+    return isinstance(input, dict) and "docs" in input
+
+
+def retrieval(retriever, filter=None):
+    """Runnable that retrieves for the input's question, limited by `filter` and the input's "filter" key."""
+    def search_kwargs(input):
+        where = combine_filters(filter, input.get("filter") if isinstance(input, dict) else None)
+        return {"filter": where} if where else {}
+
+    def retrieve(input, config):
+        return retriever.invoke(get_question(input), config, **search_kwargs(input))
+
+    async def aretrieve(input, config):
+        return await retriever.ainvoke(get_question(input), config, **search_kwargs(input))
+    return RunnableLambda(retrieve, afunc=aretrieve)
+
+
+# `filter` is a metadata filter in Chroma `where` syntax applied to every retrieval; a dict input
+# can also carry its own, e.g. {"question": ..., "filter": {"source": "data/meal_plan.txt"}}.
+def make_rag_chain(model, retriever, rag_prompt = None, semantic_cache=None, max_context_tokens=MAX_CONTEXT_TOKENS,
+                   filter=None):
+    # The langchain hub's rlm/rag-prompt, from the bundled copy unless a refresh is asked for.
     if not rag_prompt:
-        rag_prompt = hub.pull("rlm/rag-prompt")
+        rag_prompt = get_prompt(RAG_PROMPT)
+
+    generate = rag_prompt | model
+    # Near-identical questions over the same retrieved context are answered from the cache.
+    if semantic_cache:
+        generate = semantic_cache.wrap(generate, get_question)
+
+    # Documents already retrieved upstream (e.g. speculatively by the memory chain) are used as is.
+    retrieve = RunnableBranch(
+        (inline_lambda(has_docs), inline_lambda(itemgetter("docs"))),
+        retrieval(retriever, filter),
+    )
+
+    # The context is packed into a fixed token budget; pass max_context_tokens=None to send every document.
+    if max_context_tokens is None:
+        build_context = inline_lambda(format_docs)
+    else:
+        build_context = inline_lambda(lambda docs: assemble_context(docs, max_context_tokens))
 
-    # And we will use the LangChain RunnablePassthrough to add some custom processing into our chain.
     rag_chain = (
             {
-                "context": RunnableLambda(get_question) | retriever | format_docs,
-                "question": RunnablePassthrough()
+                "context": retrieve | build_context,
+                "question": inline_lambda(get_question)
             }
-            | rag_prompt
-            | model
+            | generate
     )
 
     return rag_chain
 
 
 def main():
+    from basic_chain import basic_chain, get_model
+    from remote_loader import get_wiki_docs
+    from splitter import split_documents
+    from vector_store import create_vector_db
+
     load_dotenv()
     model = get_model("ChatGPT")
     docs = get_wiki_docs(query="Bertrand Russell", load_max_docs=5)
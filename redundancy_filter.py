@@ -0,0 +1,65 @@
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import BaseDocumentTransformer, Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from pydantic import BaseModel, ConfigDict
+
+from embedding_cache import CachedEmbeddings
+from metrics import REGISTRY
+from vector_store import chunk_id
+
+
+def redundant_mask(vectors, threshold):
+    """Boolean mask keeping each vector unless an earlier kept one has cosine similarity above `threshold`."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms == 0, 1, norms)
+    similarity = unit @ unit.T
+    keep = np.ones(len(vectors), dtype=bool)
+    for i in range(1, len(vectors)):
+        keep[i] = not (similarity[i, :i][keep[:i]] > threshold).any()
+    return keep
+
+
+class StoredEmbeddingsRedundantFilter(BaseDocumentTransformer, BaseModel):
+    """Drops redundant documents using the vectors already stored for them.
+
+    Vectors are read from `vectorstore` by document ID, then from the embedding cache; only
+    documents found in neither are embedded, so deduplication normally costs no model calls.
+    """
+
+    vectorstore: VectorStore
+    """Store holding the vectors of the retrieved documents."""
+    embeddings: Optional[Embeddings] = None
+    """Embeddings for documents missing from the store; defaults to the store's own."""
+    similarity_threshold: float = 0.95
+    """Documents at least this similar to a better-ranked one are dropped."""
+
+    model_config = ConfigDict(
+        arbitrary_types_allowed=True,
+    )
+
+    def stored_vectors(self, documents):
+        ids = [doc.id or chunk_id(doc) for doc in documents]
+        stored = self.vectorstore.get(ids=list(dict.fromkeys(ids)), include=["embeddings"])
+        by_id = dict(zip(stored["ids"], stored["embeddings"]))
+        vectors = [by_id.get(i) for i in ids]
+
+        missing = [n for n, vector in enumerate(vectors) if vector is None]
+        embeddings = self.embeddings or self.vectorstore.embeddings
+        if missing and isinstance(embeddings, CachedEmbeddings):
+            for n, vector in zip(missing, embeddings.lookup([documents[n].page_content for n in missing])):
+                vectors[n] = vector
+            missing = [n for n in missing if vectors[n] is None]
+        if missing:
+            for n, vector in zip(missing, embeddings.embed_documents([documents[n].page_content for n in missing])):
+                vectors[n] = vector
+        return np.asarray(vectors, dtype=np.float32)
+
+    def transform_documents(self, documents: Sequence[Document], **kwargs: Any) -> Sequence[Document]:
+        if len(documents) < 2:
+            return list(documents)
+        with REGISTRY.timer("redundancy_filter"):
+            keep = redundant_mask(self.stored_vectors(documents), self.similarity_threshold)
+        return [doc for doc, kept in zip(documents, keep) if kept]
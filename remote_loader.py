@@ -1,9 +1,17 @@
-import requests
+import contextlib
+import hashlib
+import json
 import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from langchain_core.documents import Document
 
-from langchain_community.document_loaders import WebBaseLoader, WikipediaLoader
-from local_loader import get_document_text
-from langchain_community.document_loaders import OnlinePDFLoader
+from model_registry import get_or_create
 
 
 # if you want it locally, you can use:
@@ -13,16 +21,178 @@ CONTENT_DIR = os.path.dirname(__file__)
 # an alternative if you want it in /tmp or equivalent.
 # CONTENT_DIR = tempfile.gettempdir()
 
+# Downloaded bodies, keyed by URL, with their ETag/Last-Modified in a sidecar file.
+REMOTE_CACHE_DIR = os.path.join("store", "remote")
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+REQUEST_TIMEOUT = (10, 60)
+MAX_WORKERS = 16
+MAX_REQUESTS_PER_HOST = 4
+WIKI_CACHE_MAX_AGE = 7 * 24 * 3600
+
+_host_limits = {}
+_url_locks = {}
+_host_lock = threading.Lock()
+
+
+def _create_session():
+    from requests.adapters import HTTPAdapter
+    from urllib3.util import Retry
+
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = os.environ.get("USER_AGENT", "example-app-langchain-rag")
+    return session
+
+
+def get_session():
+    """One pooled, keep-alive requests session shared by every download in the process."""
+    return get_or_create("requests_session", _create_session)
+
+
+def _host_limit(url):
+    host = urlsplit(url).netloc
+    with _host_lock:
+        return _host_limits.setdefault(host, threading.BoundedSemaphore(MAX_REQUESTS_PER_HOST))
+
+
+def _url_lock(url):
+    # Two downloads of the same URL would write to the same .part file.
+    with _host_lock:
+        return _url_locks.setdefault(url, threading.Lock())
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def cache_path(url):
+    return os.path.join(REMOTE_CACHE_DIR, _digest(url))
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def _validators(response):
+    return {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+
+def fetch(url, max_age=None):
+    """Local path of the body of `url`, downloaded into the cache or revalidated there.
+
+    A cached copy younger than `max_age` seconds is used without asking the server; otherwise
+    the request carries the cached ETag/Last-Modified, so an unchanged source costs a 304 and no
+    transfer. Bodies are streamed to a .part file in chunks, and an interrupted download is
+    resumed with a Range request as long as the server still has the same version.
+    """
+    with _url_lock(url):
+        return _fetch(url, max_age)
+
+
+def _fetch(url, max_age):
+    path = cache_path(url)
+    meta = _read_json(path + ".json")
+    if meta and not os.path.exists(path):
+        meta = None
+    if meta and max_age is not None and time.time() - meta["fetched_at"] < max_age:
+        return path
+
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    part_path = path + ".part"
+    part_meta = _read_json(part_path + ".json") or {}
+    # Only resume when the partial download can be tied to a version of the resource.
+    validator = part_meta.get("etag") or part_meta.get("last_modified")
+    if validator and os.path.exists(part_path) and os.path.getsize(part_path):
+        headers["Range"] = f"bytes={os.path.getsize(part_path)}-"
+        # If the resource changed since then, the server sends all of it instead of the rest.
+        headers["If-Range"] = validator
+
+    os.makedirs(REMOTE_CACHE_DIR, exist_ok=True)
+    with _host_limit(url), get_session().get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 304:
+            _write_json(path + ".json", {**meta, "fetched_at": time.time()})
+            return path
+        # A 416 to anything but our Range request is an ordinary error.
+        restart = response.status_code == 416 and "Range" in headers
+        if not restart:
+            response.raise_for_status()
+            validators = _validators(response)
+            if response.status_code == 206:
+                validators = {key: validators[key] or part_meta.get(key) for key in validators}
+            _write_json(part_path + ".json", validators)
+            with open(part_path, "ab" if response.status_code == 206 else "wb") as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+    if restart:
+        # The partial file is no prefix of the resource (e.g. it shrank); start over.
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(part_path)
+        return _fetch(url, max_age)
+    os.replace(part_path, path)
+    _write_json(path + ".json", {"url": url, **validators, "fetched_at": time.time()})
+    os.remove(part_path + ".json")
+    return path
+
+
+def fetch_many(urls, max_workers=MAX_WORKERS, max_age=None):
+    """Local paths of `urls`, in order, fetched concurrently but at most
+    MAX_REQUESTS_PER_HOST at a time from any one host."""
+    urls = list(urls)
+    unique = list(dict.fromkeys(urls))
+    if len(unique) <= 1:
+        return [fetch(url, max_age) for url in urls]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique)), thread_name_prefix="fetch") as executor:
+        paths = dict(zip(unique, executor.map(lambda url: fetch(url, max_age), unique)))
+    return [paths[url] for url in urls]
+
+
+def _html_document(url, path):
+    # The same text and metadata WebBaseLoader would give, parsed from the cached copy.
+    from bs4 import BeautifulSoup
+
+    with open(path, "rb") as f:
+        soup = BeautifulSoup(f, "html.parser")
+    metadata = {"source": url}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    if description := soup.find("meta", attrs={"name": "description"}):
+        metadata["description"] = description.get("content", "No description found.")
+    if html := soup.find("html"):
+        metadata["language"] = html.get("lang", "No language found.")
+    return Document(page_content=soup.get_text(), metadata=metadata)
+
+
+# Takes one URL or a list of them; pages are fetched concurrently and cached between runs.
 def load_web_page(page_url):
-    loader = WebBaseLoader(page_url)
-    data = loader.load()
-    return data
+    urls = [page_url] if isinstance(page_url, str) else list(page_url)
+    return [_html_document(url, path) for url, path in zip(urls, fetch_many(urls))]
 
 
 def load_online_pdf(pdf_url):
-    loader = OnlinePDFLoader(pdf_url)
-    data = loader.load()
-    return data
+    from local_loader import iter_pdf_pages
+
+    with open(fetch(pdf_url), "rb") as f:
+        data = f.read()
+    return [Document(page_content=text, metadata={"source": pdf_url, "page": num, "doc_type": "pdf"})
+            for num, text in enumerate(iter_pdf_pages(data), start=1)]
 
 
 def filename_from_url(url):
@@ -31,28 +201,39 @@ def filename_from_url(url):
 
 
 def download_file(url, filename=None):
-    response = requests.get(url)
     if not filename:
         filename = filename_from_url(url)
 
     full_path = os.path.join(CONTENT_DIR, filename)
-
-    with open(full_path, mode="wb") as f:
-        f.write(response.content)
-        download_path = os.path.realpath(f.name)
+    cached = fetch(url)
+    # Copied in chunks, and only when the cache holds a newer copy than the one already there.
+    if not os.path.exists(full_path) or os.path.getmtime(full_path) < os.path.getmtime(cached):
+        shutil.copyfile(cached, full_path)
+    download_path = os.path.realpath(full_path)
     print(f"Downloaded file {filename} to {download_path}")
     return download_path
 
 
-def get_wiki_docs(query, load_max_docs=2):
-    wiki_loader = WikipediaLoader(query=query, load_max_docs=load_max_docs)
-    docs = wiki_loader.load()
+def get_wiki_docs(query, load_max_docs=2, max_age=WIKI_CACHE_MAX_AGE):
+    path = os.path.join(REMOTE_CACHE_DIR, "wiki", f"{_digest(f'{query}:{load_max_docs}')}.json")
+    cached = _read_json(path)
+    if cached and time.time() - cached["fetched_at"] < max_age:
+        docs = [Document(**doc) for doc in cached["docs"]]
+    else:
+        from langchain_community.document_loaders import WikipediaLoader
+        wiki_loader = WikipediaLoader(query=query, load_max_docs=load_max_docs)
+        docs = wiki_loader.load()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_json(path, {"fetched_at": time.time(),
+                           "docs": [{"page_content": d.page_content, "metadata": d.metadata} for d in docs]})
     for d in docs:
         print(d.metadata["title"])
     return docs
 
 
 def main():
+    from local_loader import get_document_text
+
     # run through the different remote loading functions.
     problems_of_philosophy_by_russell = "https://www.gutenberg.org/ebooks/5827.html.images"
     docs = load_web_page(problems_of_philosophy_by_russell)
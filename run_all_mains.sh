@@ -2,7 +2,7 @@
 
 set -e 
 
-FILES_WITH_MAIN=`grep -l main *.py | grep -v streamlit_app`
+FILES_WITH_MAIN=`grep -l main *.py | grep -v -e streamlit_app -e api_server -e benchmark`
 for F in $FILES_WITH_MAIN; do
     echo "Running $F"
     python $F
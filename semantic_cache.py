@@ -0,0 +1,130 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import RunnableGenerator
+
+from metrics import REGISTRY
+
+
+def context_fingerprint(context):
+    return hashlib.sha256(str(context).encode("utf-8")).hexdigest()
+
+
+def replay(answer):
+    # Re-emit a cached answer word by word so streaming consumers such as st.write_stream still work.
+    for piece in re.findall(r"\s*\S+", answer) or [answer]:
+        yield AIMessageChunk(content=piece)
+
+
+class SemanticCache:
+    """Answers keyed on the embedding of the standalone question and the retrieved context.
+
+    A lookup hits when a stored question under the same context fingerprint has cosine
+    similarity of at least `threshold`. Because the fingerprint covers the retrieved chunks,
+    any change to the collection that changes what is retrieved also misses the cache.
+    Entries expire after `ttl` seconds and the least recently used are evicted beyond
+    `max_entries`.
+    """
+
+    def __init__(self, embeddings, threshold=0.95, ttl=3600, max_entries=512):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _match(self, vector, context):
+        fingerprint = context_fingerprint(context)
+        now = time.time()
+        with self.lock:
+            expired = [key for key, entry in self.entries.items() if now - entry["created"] > self.ttl]
+            for key in expired:
+                del self.entries[key]
+            candidates = [key for key, entry in self.entries.items() if entry["context"] == fingerprint]
+            if candidates:
+                similarities = np.stack([self.entries[key]["vector"] for key in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.entries.move_to_end(candidates[best])
+                    self.hits += 1
+                    REGISTRY.inc("rag_cache_requests_total", cache="semantic", result="hit")
+                    return self.entries[candidates[best]]["answer"]
+            self.misses += 1
+        REGISTRY.inc("rag_cache_requests_total", cache="semantic", result="miss")
+        return None
+
+    def _put(self, question, vector, context, answer):
+        entry = {"vector": vector, "context": context_fingerprint(context), "answer": answer, "created": time.time()}
+        key = (question, entry["context"])
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def lookup(self, question, context):
+        return self._match(self._normalize(self.embeddings.embed_query(question)), context)
+
+    async def alookup(self, question, context):
+        return self._match(self._normalize(await self.embeddings.aembed_query(question)), context)
+
+    def store(self, question, context, answer):
+        self._put(question, self._normalize(self.embeddings.embed_query(question)), context, answer)
+
+    async def astore(self, question, context, answer):
+        self._put(question, self._normalize(await self.embeddings.aembed_query(question)), context, answer)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def wrap(self, generate, get_question):
+        """Put the cache in front of `generate`, which maps {"context", "question"} to a message."""
+
+        def merge(chunks):
+            inputs = {}
+            for chunk in chunks:
+                inputs.update(chunk)
+            return inputs
+
+        def transform(chunks, config):
+            inputs = merge(chunks)
+            question = get_question(inputs["question"])
+            answer = self.lookup(question, inputs["context"])
+            if answer is not None:
+                yield from replay(answer)
+                return
+            pieces = []
+            for chunk in generate.stream(inputs, config):
+                pieces.append(getattr(chunk, "content", chunk))
+                yield chunk
+            self.store(question, inputs["context"], "".join(pieces))
+
+        async def atransform(chunks, config):
+            inputs = merge([chunk async for chunk in chunks])
+            question = get_question(inputs["question"])
+            answer = await self.alookup(question, inputs["context"])
+            if answer is not None:
+                for chunk in replay(answer):
+                    yield chunk
+                return
+            pieces = []
+            async for chunk in generate.astream(inputs, config):
+                pieces.append(getattr(chunk, "content", chunk))
+                yield chunk
+            await self.astore(question, inputs["context"], "".join(pieces))
+
+        return RunnableGenerator(transform, atransform, name="semantic_cache")
@@ -0,0 +1,117 @@
+import json
+import os
+
+import numpy as np
+
+from document_log import DocumentLog, save_array
+from metadata_filter import MetadataIndex
+
+# Share of deleted slots at which save() rewrites an index's files without them.
+COMPACT_DEAD_FRACTION = 0.25
+
+
+class SlotIndex:
+    """Base for indexes that keep their documents in a DocumentLog, addressed by slot number.
+
+    Here are the slot ids, tombstones and metadata index; the subclass keeps its own per-slot
+    arrays (postings, codes) alongside, in files named `{name}_*.npy`. Deletes only clear a
+    slot's `alive` flag until COMPACT_DEAD_FRACTION of the slots are dead, when the subclass's
+    save() calls _compact_slots() to renumber the live ones from 0. `{name}.json` is written
+    last, so the files of an interrupted save disagree with it and the index starts empty.
+    """
+
+    def _open_slots(self, directory, name):
+        """Open the document log and return the saved `{name}.json`, or None if there is none."""
+        self.directory = directory
+        self.name = name
+        self.docs = DocumentLog(directory)
+        self.slot_ids = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.dirty = False
+        meta_path = os.path.join(directory, f"{name}.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _load_slots(self, meta, rows=()):
+        """Take the saved slots in `meta` if the alive flags, each per-slot array in `rows` and the
+        document log all agree with them, and return whether they did; otherwise start empty.
+        Documents appended after the last save have no slot and are dropped either way."""
+        loaded = False
+        if meta is not None:
+            alive = np.load(self._path("alive"))
+            if all(len(array) == len(meta["ids"]) for array in (alive, *rows)) and len(meta["ids"]) <= len(self.docs):
+                self.slot_ids = meta["ids"]
+                self.alive = alive
+                loaded = True
+        del self.docs.offsets[len(self.slot_ids):]
+        self.metadata = MetadataIndex.load(self.directory, f"{self.name}_metadata", len(self.slot_ids))
+        if self.metadata is None:
+            self.metadata = MetadataIndex()
+            if self.slot_ids:
+                # Saved before metadata was indexed, or interrupted: rebuild from the stored documents.
+                self.metadata.add(doc.metadata for doc in self.docs.get(range(len(self.slot_ids))))
+        self.id_to_slot = {doc_id: slot for slot, doc_id in enumerate(self.slot_ids) if self.alive[slot]}
+        return loaded
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{self.name}_{name}.npy")
+
+    def __len__(self):
+        return len(self.id_to_slot)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.id_to_slot
+
+    def ids(self, where=None):
+        """Ids of the live documents, or of those whose metadata passes `where`."""
+        if not where:
+            return list(self.id_to_slot)
+        return [self.slot_ids[slot] for slot in np.flatnonzero(self.alive & self.metadata.mask(where))]
+
+    def _add_slots(self, docs, ids):
+        self.docs.append(docs, ids)
+        self.metadata.add(doc.metadata for doc in docs)
+        for doc_id in ids:
+            self.id_to_slot[doc_id] = len(self.slot_ids)
+            self.slot_ids.append(doc_id)
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        self.dirty = True
+
+    def _delete_slots(self, ids):
+        """Tombstone `ids` and return the slots they had."""
+        slots = []
+        for doc_id in ids:
+            slot = self.id_to_slot.pop(doc_id, None)
+            if slot is not None:
+                self.alive[slot] = False
+                slots.append(slot)
+        self.dirty = self.dirty or bool(slots)
+        return slots
+
+    def _needs_compaction(self):
+        return len(self.alive) and 1 - np.count_nonzero(self.alive) / len(self.alive) >= COMPACT_DEAD_FRACTION
+
+    def _compact_slots(self):
+        """Drop the dead slots from the document log and metadata and renumber the live ones from 0.
+
+        Returns the old numbers of the live slots, for the subclass to compact its own arrays.
+        """
+        live = np.flatnonzero(self.alive)
+        self.docs.compact(live.tolist())
+        self.metadata = self.metadata.take(live)
+        self.slot_ids = [self.slot_ids[slot] for slot in live]
+        self.id_to_slot = {doc_id: slot for slot, doc_id in enumerate(self.slot_ids)}
+        self.alive = np.ones(len(live), dtype=bool)
+        return live
+
+    def _save_slots(self, meta):
+        """Write the tombstones, metadata index and, last, `{name}.json` with `meta` and the slot ids."""
+        save_array(self._path("alive"), self.alive)
+        self.metadata.save(self.directory, f"{self.name}_metadata")
+        meta_path = os.path.join(self.directory, f"{self.name}.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({**meta, "ids": self.slot_ids}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        self.dirty = False
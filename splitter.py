@@ -1,20 +1,120 @@
 # Split documents into chunks
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.docstore.document import Document
+import hashlib
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
 
+from langchain_core.documents import Document
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
 
-def split_documents(docs):
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=0,
-        length_function=len,
+from tokens import count_tokens
+
+# Sizes are in tokens of the tokens.ENCODING_NAME encoding (roughly the old 1000 characters).
+CHUNK_SIZE = 250
+CHUNK_OVERLAP = 25
+DOCS_PER_TASK = 16
+
+SEPARATORS = {
+    "text": ["\n\n", "\n", ". ", " ", ""],
+    "markdown": RecursiveCharacterTextSplitter.get_separators_for_language(Language.MARKDOWN),
+    # A CSV row is "column: value" lines; keep lines whole so a value is never cut in two.
+    "csv": ["\n", " ", ""],
+}
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$", re.MULTILINE)
+# Same output as json.dumps(..., sort_keys=True, default=str), without building an encoder per chunk.
+_metadata_encoder = json.JSONEncoder(sort_keys=True, default=str)
+
+
+def chunk_id(doc):
+    # Stable ID for a chunk: hash of its text plus the metadata that says where it came from.
+    metadata = {k: v for k, v in doc.metadata.items() if k != "chunk_id"}
+    digest = hashlib.sha256(doc.page_content.encode("utf-8"))
+    digest.update(_metadata_encoder.encode(metadata).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def document_kind(doc):
+    if "row" in doc.metadata:
+        return "csv"
+    if str(doc.metadata.get("source", "")).endswith(".md") or HEADING_RE.search(doc.page_content):
+        return "markdown"
+    return "text"
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter(kind="text", chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    return RecursiveCharacterTextSplitter(
+        separators=SEPARATORS[kind],
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=count_tokens,
+        add_start_index=True,
         is_separator_regex=False)
 
-    contents = docs
-    if docs and isinstance(docs[0], Document):
-        contents = [doc.page_content for doc in docs]
 
-    texts = text_splitter.create_documents(contents)
+def section_path(headings, position):
+    # The headings in force at `position`, outermost first.
+    path = []
+    for start, level, title in headings:
+        if start > position:
+            break
+        path = [p for p in path if p[0] < level] + [(level, title)]
+    return " > ".join(title for _, title in path)
+
+
+def split_document(doc, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Chunks of one document, carrying its metadata plus doc_type, start_index, section and chunk_id."""
+    if not isinstance(doc, Document):
+        doc = Document(page_content=doc)
+    kind = document_kind(doc)
+    # doc_type is there to filter on; a loader that knows better (e.g. "pdf") sets it itself.
+    metadata = {"doc_type": kind, **doc.metadata}
+    text = doc.page_content
+    if kind != "markdown" and len(text.encode("utf-8")) <= chunk_size:
+        # A token is at least one byte, so this fits in one chunk without counting tokens; typical of CSV rows.
+        stripped = text.strip()
+        start = len(text) - len(text.lstrip())
+        chunks = [Document(page_content=stripped, metadata={**metadata, "start_index": start})] if stripped else []
+    else:
+        chunks = get_text_splitter(kind, chunk_size, chunk_overlap).create_documents([text], metadatas=[metadata])
+    if kind == "markdown":
+        headings = [(m.start(), len(m.group(1)), m.group(2)) for m in HEADING_RE.finditer(doc.page_content)]
+        for chunk in chunks:
+            section = section_path(headings, chunk.metadata["start_index"])
+            if section:
+                chunk.metadata["section"] = section
+    for chunk in chunks:
+        chunk.id = chunk.metadata["chunk_id"] = chunk_id(chunk)
+    return chunks
+
+
+def _split_many(docs, chunk_size, chunk_overlap):
+    return [chunk for doc in docs for chunk in split_document(doc, chunk_size, chunk_overlap)]
+
+
+# Splits one document at a time, so it can sit between a lazy loader and the vector store.
+# With workers > 1, groups of documents are split in a process pool, a bounded number at a time.
+def iter_split_documents(docs, workers=1, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    if workers <= 1:
+        for doc in docs:
+            yield from split_document(doc, chunk_size, chunk_overlap)
+        return
+
+    docs = iter(docs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            tasks = [list(islice(docs, DOCS_PER_TASK)) for _ in range(workers * 2)]
+            tasks = [task for task in tasks if task]
+            if not tasks:
+                break
+            for chunks in executor.map(_split_many, tasks, [chunk_size] * len(tasks), [chunk_overlap] * len(tasks)):
+                yield from chunks
+
+
+def split_documents(docs, workers=1, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    texts = list(iter_split_documents(docs, workers, chunk_size, chunk_overlap))
     n_chunks = len(texts)
     print(f"Split into {n_chunks} chunks")
     return texts
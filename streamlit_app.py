@@ -2,12 +2,12 @@ import streamlit as st
 from streamlit_cookies_controller import CookieController
 
 from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from langchain_huggingface import HuggingFaceEndpointEmbeddings
 
 import cookie_history
 from ensemble import ensemble_retriever_from_docs
 from full_chain import create_full_chain, ask_question
 from local_loader import load_txt_files
+from model_registry import get_embeddings
 
 import feedback
 
@@ -50,17 +50,19 @@ def show_ui(qa, prompt_to_user="How may I help you?"):
 def get_retriever(huggingfacehub_api_token=None):
     docs = load_txt_files()
     # embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, model="text-embedding-3-small")
-    embeddings = HuggingFaceEndpointEmbeddings(model="sentence-transformers/all-MiniLM-L6-v2",
-                                               huggingfacehub_api_token=huggingfacehub_api_token)
+    embeddings = get_embeddings("sentence-transformers/all-MiniLM-L6-v2", provider="huggingface-endpoint",
+                                huggingfacehub_api_token=huggingfacehub_api_token)
     return ensemble_retriever_from_docs(docs, embeddings=embeddings)
 
 
 def get_chain(groq_api_key=None, huggingfacehub_api_token=None):
-    ensemble_retriever = get_retriever(huggingfacehub_api_token=huggingfacehub_api_token)
-    chain = create_full_chain(ensemble_retriever,
-                              huggingfacehub_api_token=huggingfacehub_api_token,
-                              chat_memory=StreamlitChatMessageHistory(key="langchain_messages"))
-    return chain
+    # Built once per browser session so the chat memory's running summary survives reruns.
+    if "chain" not in st.session_state:
+        ensemble_retriever = get_retriever(huggingfacehub_api_token=huggingfacehub_api_token)
+        st.session_state.chain = create_full_chain(ensemble_retriever,
+                                                   huggingfacehub_api_token=huggingfacehub_api_token,
+                                                   chat_memory=StreamlitChatMessageHistory(key="langchain_messages"))
+    return st.session_state.chain
 
 
 def get_secret_or_input(secret_key, secret_name, info_link=None):
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+import bm25_index
+from bm25_index import BM25Index
+from slot_index import COMPACT_DEAD_FRACTION
+
+FOODS = ["oats and barley", "walnuts and almonds", "barley soup", "almond milk", "oat milk",
+         "rye bread", "wheat bread", "rice and beans"]
+
+
+def add(index, texts):
+    docs = [Document(page_content=text, metadata={"source": f"{text.split()[0]}.txt", "n": n})
+            for n, text in enumerate(texts)]
+    index.add_documents(docs, ids=texts)
+
+
+def crash(path, array):
+    raise OSError("disk full")
+
+
+def contents(docs):
+    return [doc.page_content for doc in docs]
+
+
+def test_save_and_reload(tmp_path):
+    index = BM25Index(str(tmp_path))
+    add(index, FOODS)
+    index.save()
+    reloaded = BM25Index(str(tmp_path))
+    assert sorted(reloaded.ids()) == sorted(FOODS)
+    assert contents(reloaded.search("barley", k=8)) == contents(index.search("barley", k=8))
+    assert contents(reloaded.search("milk", filter={"source": "oat.txt"})) == ["oat milk"]
+    # Nothing changed, so saving again writes nothing.
+    mtime = os.path.getmtime(tmp_path / "bm25.json")
+    reloaded.save()
+    assert os.path.getmtime(tmp_path / "bm25.json") == mtime
+
+
+def test_compaction_keeps_ids_postings_and_filters(tmp_path):
+    index = BM25Index(str(tmp_path))
+    add(index, FOODS)
+    index.save()
+    deleted = FOODS[:int(len(FOODS) * COMPACT_DEAD_FRACTION) + 1]
+    index.delete(deleted)
+    add(index, ["barley bread"])
+    expected = {query: contents(index.search(query, k=8)) for query in ("barley", "bread", "milk", "and")}
+    index.save()
+
+    reloaded = BM25Index(str(tmp_path))
+    live = sorted(set(FOODS) - set(deleted) | {"barley bread"})
+    assert sorted(reloaded.ids()) == live
+    assert len(reloaded.docs) == len(reloaded.slot_ids) == len(live)
+    assert reloaded.alive.all()
+    for query, docs in expected.items():
+        assert contents(reloaded.search(query, k=8)) == docs
+    assert reloaded.ids({"source": "barley.txt"}) == ["barley bread"]
+    assert contents(reloaded.search("bread", filter={"source": {"$in": ["rye.txt", "wheat.txt"]}})) == \
+        ["rye bread", "wheat bread"]
+
+
+def test_crash_after_compacting_the_document_log(tmp_path, monkeypatch):
+    index = BM25Index(str(tmp_path))
+    add(index, FOODS)
+    index.save()
+    index.delete(FOODS[:4])
+    # The document log is already rewritten when the first array is written.
+    monkeypatch.setattr(bm25_index, "save_array", crash)
+    with pytest.raises(OSError):
+        index.save()
+    monkeypatch.undo()
+
+    # bm25.json still describes the old slots, which no longer match the log: start empty.
+    reloaded = BM25Index(str(tmp_path))
+    assert reloaded.ids() == [] and reloaded.search("barley") == []
+    add(reloaded, FOODS[4:])
+    reloaded.save()
+    reloaded = BM25Index(str(tmp_path))
+    assert sorted(reloaded.ids()) == sorted(FOODS[4:])
+    assert contents(reloaded.search("milk", k=8)) == ["oat milk"]
+
+
+def test_crash_before_arrays_keeps_last_save(tmp_path, monkeypatch):
+    index = BM25Index(str(tmp_path))
+    add(index, FOODS[:4])
+    index.save()
+    add(index, FOODS[4:])
+    monkeypatch.setattr(bm25_index, "save_array", crash)
+    with pytest.raises(OSError):
+        index.save()
+    monkeypatch.undo()
+
+    reloaded = BM25Index(str(tmp_path))
+    assert sorted(reloaded.ids()) == sorted(FOODS[:4])
+    assert contents(reloaded.search("barley", k=8)) == ["barley soup", "oats and barley"]
@@ -0,0 +1,114 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from hybrid_retriever import HybridRetriever
+
+
+class SleepyRetriever(BaseRetriever):
+    name: str
+    delay: float = 0.0
+    release: threading.Event = None
+
+    def _get_relevant_documents(self, query, *, run_manager) -> List[Document]:
+        if self.release is not None:
+            self.release.wait(5)
+        time.sleep(self.delay)
+        return [Document(page_content=f"{self.name}: {query}")]
+
+
+def test_hung_child_does_not_starve_fast_child():
+    release = threading.Event()
+    fast = SleepyRetriever(name="fast", delay=0.01)
+    hung = SleepyRetriever(name="hung", release=release)
+    retriever = HybridRetriever(retrievers=[fast, hung], timeout=0.5)
+    try:
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            results = list(pool.map(retriever.invoke, [f"q{i}" for i in range(20)]))
+    finally:
+        release.set()
+    assert all([doc.page_content for doc in docs] == [f"fast: q{i}"] for i, docs in enumerate(results))
+
+
+def test_saturated_child_is_skipped_without_waiting():
+    release = threading.Event()
+    fast = SleepyRetriever(name="fast")
+    hung = SleepyRetriever(name="hung", release=release)
+    retriever = HybridRetriever(retrievers=[fast, hung], timeout=0.2, max_pending=2)
+    try:
+        for _ in range(2):
+            retriever.invoke("q")
+        # Both of the hung child's slots are taken, so it is refused instead of timing out again.
+        start = time.monotonic()
+        docs = retriever.invoke("q")
+        assert time.monotonic() - start < 0.1
+        assert [doc.page_content for doc in docs] == ["fast: q"]
+    finally:
+        release.set()
+
+
+async def _ainvoke_all(retriever, queries):
+    import asyncio
+    return await asyncio.gather(*(retriever.ainvoke(query) for query in queries))
+
+
+def test_async_hung_child_does_not_starve_fast_child():
+    import asyncio
+    release = threading.Event()
+    fast = SleepyRetriever(name="fast", delay=0.01)
+    hung = SleepyRetriever(name="hung", release=release)
+    retriever = HybridRetriever(retrievers=[fast, hung], timeout=0.5)
+    try:
+        results = asyncio.run(_ainvoke_all(retriever, [f"q{i}" for i in range(20)]))
+    finally:
+        release.set()
+    assert all([doc.page_content for doc in docs] == [f"fast: q{i}"] for i, docs in enumerate(results))
+
+
+def test_async_saturated_child_is_skipped_without_waiting():
+    import asyncio
+    release = threading.Event()
+    fast = SleepyRetriever(name="fast")
+    hung = SleepyRetriever(name="hung", release=release)
+    retriever = HybridRetriever(retrievers=[fast, hung], timeout=0.2, max_pending=2)
+    try:
+        for _ in range(2):
+            asyncio.run(retriever.ainvoke("q"))
+        # The timed-out calls' threads are still stuck, so they keep the hung child's slots.
+        start = time.monotonic()
+        docs = asyncio.run(retriever.ainvoke("q"))
+        assert time.monotonic() - start < 0.1
+        assert [doc.page_content for doc in docs] == ["fast: q"]
+    finally:
+        release.set()
+
+
+def test_async_vector_search_runs_on_child_threads():
+    import asyncio
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from langchain_core.vectorstores import InMemoryVectorStore
+
+    from vector_store import as_retriever
+
+    class HungStore(InMemoryVectorStore):
+        def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+            release.wait(5)
+            return super().similarity_search_by_vector(embedding, k, **kwargs)
+
+    release = threading.Event()
+    store = HungStore(DeterministicFakeEmbedding(size=8))
+    store.add_texts(["hung"])
+    fast = SleepyRetriever(name="fast")
+    retriever = HybridRetriever(retrievers=[fast, as_retriever(store)], timeout=0.2, max_pending=1)
+    try:
+        asyncio.run(retriever.ainvoke("q"))
+        start = time.monotonic()
+        docs = asyncio.run(retriever.ainvoke("q"))
+        assert time.monotonic() - start < 0.1
+        assert [doc.page_content for doc in docs] == ["fast: q"]
+    finally:
+        release.set()
@@ -0,0 +1,42 @@
+from langchain_community.document_loaders.csv_loader import CSVLoader
+
+import local_loader
+from local_loader import lazy_load_table, load_csv_files
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def as_pairs(docs):
+    return [(doc.page_content, doc.metadata) for doc in docs]
+
+
+def test_matches_csv_loader(tmp_path):
+    path = write(tmp_path, "foods.csv", "Food,Grams,Category\nMilk , 976,Dairy\n\nTea,230,\"Drinks, hot\"\n")
+    assert as_pairs(lazy_load_table(path)) == as_pairs(CSVLoader(path).load())
+
+
+def test_ragged_rows_match_csv_loader(tmp_path):
+    path = write(tmp_path, "ragged.csv", "a,b,c\n1,2,3\n4\n5,6,7,8\n\n9,,10\n")
+    assert as_pairs(lazy_load_table(path)) == as_pairs(CSVLoader(path).load())
+
+
+def test_ragged_row_after_first_batch(tmp_path, monkeypatch):
+    # Small blocks, so some batches are yielded by Arrow before it reaches the bad row.
+    monkeypatch.setattr(local_loader, "TABLE_BLOCK_BYTES", 1 << 12)
+    rows = "".join(f"{i},{i}\n" for i in range(5000))
+    path = write(tmp_path, "big.csv", "a,b\n" + rows + "short\n" + rows)
+    docs = list(lazy_load_table(path, batch_size=1000))
+    assert as_pairs(docs) == as_pairs(CSVLoader(path).load())
+
+
+def test_empty_files_give_no_rows(tmp_path):
+    empty = write(tmp_path, "empty.csv", "")
+    header = write(tmp_path, "header.csv", "a,b\n")
+    good = write(tmp_path, "good.csv", "a,b\n1,2\n")
+    assert list(lazy_load_table(empty)) == CSVLoader(empty).load() == []
+    assert list(lazy_load_table(header)) == CSVLoader(header).load() == []
+    assert as_pairs(load_csv_files(str(tmp_path))) == as_pairs(CSVLoader(good).load())
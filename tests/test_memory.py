@@ -0,0 +1,34 @@
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from memory import SimpleTextRetriever, create_memory_chain
+from metadata_filter import matches
+from rag_chain import make_rag_chain
+
+
+class FilteringRetriever(SimpleTextRetriever):
+    def _get_relevant_documents(self, query, *, run_manager, filter=None):
+        return [doc for doc in self.docs if not filter or matches(doc.metadata, filter)]
+
+
+# Answers with its whole prompt, and "rewrites" a question into itself.
+echo = RunnableLambda(lambda prompt: AIMessage(content=prompt.messages[-1].content))
+
+
+def test_speculative_retrieval_applies_static_filter():
+    retriever = FilteringRetriever(docs=[
+        Document(page_content="Oats are in scope.", metadata={"source": "a.txt"}),
+        Document(page_content="Walnuts are out of scope.", metadata={"source": "b.txt"}),
+    ])
+    scope = {"source": "a.txt"}
+    history = ChatMessageHistory()
+    history.add_user_message("What grains are there?")
+    history.add_ai_message("Oats.")
+    rag_chain = make_rag_chain(echo, retriever, filter=scope)
+    chain = create_memory_chain(echo, rag_chain, history, speculative_retriever=retriever, filter=scope)
+    # Short and anaphoric, so it is rewritten (to itself) and the speculative docs are used.
+    answer = chain.invoke({"question": "And those?"}, config={"configurable": {"session_id": "s"}})
+    assert "Oats are in scope." in answer.content
+    assert "Walnuts" not in answer.content
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import quantized_index
+from quantized_index import QuantizedVectorStore
+from slot_index import COMPACT_DEAD_FRACTION
+
+TEXTS = [f"chunk {n}" for n in range(40)]
+EMBEDDING = DeterministicFakeEmbedding(size=32)
+
+
+def build(directory, mode):
+    store = QuantizedVectorStore(str(directory), EMBEDDING, mode=mode)
+    store.add_texts(TEXTS, [{"source": f"{n % 4}.txt", "n": n} for n in range(len(TEXTS))], ids=TEXTS)
+    return store
+
+
+def crash(path, array):
+    raise OSError("disk full")
+
+
+def search(store, text, **kwargs):
+    return [(doc.page_content, round(score, 5))
+            for doc, score in store.similarity_search_with_score(text, k=3, **kwargs)]
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_save_and_reload(tmp_path, mode):
+    store = build(tmp_path, mode)
+    store.save()
+    reloaded = QuantizedVectorStore(str(tmp_path), EMBEDDING, mode=mode)
+    assert reloaded.ids() == TEXTS
+    assert search(reloaded, "chunk 7") == search(store, "chunk 7")
+    assert search(reloaded, "chunk 7")[0] == ("chunk 7", 1.0)
+    assert search(reloaded, "chunk 7", filter={"source": "1.txt"}) == search(store, "chunk 7", filter={"source": "1.txt"})
+    assert np.array_equal(reloaded.get(ids=TEXTS[:3], include=["embeddings"])["embeddings"],
+                          store.get(ids=TEXTS[:3], include=["embeddings"])["embeddings"])
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_compaction(tmp_path, mode):
+    store = build(tmp_path, mode)
+    store.save()
+    embeddings = dict(zip(TEXTS, store.get(ids=TEXTS, include=["embeddings"])["embeddings"]))
+    deleted = TEXTS[:int(len(TEXTS) * COMPACT_DEAD_FRACTION) + 1]
+    store.delete(deleted)
+    expected = search(store, "chunk 30")
+    store.save()
+
+    live = TEXTS[len(deleted):]
+    assert store.alive.all() and len(store.slot_ids) == len(live)
+    assert (tmp_path / "vectors.f32").stat().st_size == len(live) * 32 * 4
+    reloaded = QuantizedVectorStore(str(tmp_path), EMBEDDING, mode=mode)
+    assert reloaded.ids() == live
+    assert search(reloaded, "chunk 30") == expected
+    assert reloaded.ids({"source": "1.txt"}) == [text for text in live if int(text.split()[1]) % 4 == 1]
+    # The redundancy filter reads stored vectors back by id.
+    result = reloaded.get(ids=live, include=["embeddings", "metadatas"])
+    assert result["ids"] == live
+    assert all(np.array_equal(vector, embeddings[doc_id]) for doc_id, vector in zip(live, result["embeddings"]))
+    assert [m["n"] for m in result["metadatas"]] == [int(text.split()[1]) for text in live]
+
+
+def test_crash_after_compacting_starts_empty(tmp_path, monkeypatch):
+    store = build(tmp_path, "int8")
+    store.save()
+    store.delete(TEXTS[:20])
+    monkeypatch.setattr(quantized_index, "save_array", crash)
+    with pytest.raises(OSError):
+        store.save()
+    monkeypatch.undo()
+
+    reloaded = QuantizedVectorStore(str(tmp_path), EMBEDDING)
+    assert reloaded.ids() == [] and reloaded.similarity_search("chunk 30") == []
+    reloaded.add_texts(TEXTS[20:], ids=TEXTS[20:])
+    reloaded.save()
+    assert QuantizedVectorStore(str(tmp_path), EMBEDDING).ids() == TEXTS[20:]
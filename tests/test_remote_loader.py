@@ -0,0 +1,91 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import remote_loader
+from remote_loader import cache_path, fetch
+
+BODY = b"".join(b"line %d of the remote document\n" % n for n in range(200))
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.path == "/broken":
+            return self.reply(416)
+        if self.headers.get("If-None-Match") == ETAG:
+            return self.reply(304)
+        byte_range = self.headers.get("Range")
+        if byte_range and self.headers.get("If-Range") == ETAG:
+            start = int(byte_range[len("bytes="):-len("-")])
+            if start >= len(BODY):
+                return self.reply(416)
+            return self.reply(206, BODY[start:], {"Content-Range": f"bytes {start}-{len(BODY) - 1}/{len(BODY)}"})
+        self.reply(200, BODY)
+
+    def reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(remote_loader, "REMOTE_CACHE_DIR", str(tmp_path))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path="/doc.txt"):
+    return f"http://127.0.0.1:{server.server_port}{path}"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write_part(url, data):
+    path = cache_path(url) + ".part"
+    with open(path, "wb") as f:
+        f.write(data)
+    remote_loader._write_json(path + ".json", {"etag": ETAG, "last_modified": None})
+
+
+def test_unchanged_source_is_revalidated(server):
+    assert read(fetch(url(server))) == BODY
+    assert read(fetch(url(server))) == BODY
+    assert [request.get("If-None-Match") for request in server.requests] == [None, ETAG]
+
+
+def test_truncated_part_is_resumed(server):
+    write_part(url(server), BODY[:100])
+    assert read(fetch(url(server))) == BODY
+    assert server.requests[0]["Range"] == "bytes=100-"
+    assert server.requests[0]["If-Range"] == ETAG
+
+
+def test_part_longer_than_source_starts_over(server):
+    write_part(url(server), BODY + b"stale tail")
+    assert read(fetch(url(server))) == BODY
+    assert [request.get("Range") for request in server.requests] == [f"bytes={len(BODY) + 10}-", None]
+
+
+def test_416_without_range_is_an_error(server):
+    with pytest.raises(requests.HTTPError):
+        fetch(url(server, "/broken"))
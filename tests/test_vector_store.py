@@ -0,0 +1,71 @@
+import os
+
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from bm25_index import BM25Index
+from quantized_index import QuantizedVectorStore
+from vector_store import all_ids, ingest_files, sync_documents
+
+
+def chunks(source, *texts):
+    return [Document(page_content=text, metadata={"source": source}) for text in texts]
+
+
+@pytest.fixture(params=["chroma", "quantized"])
+def db(request, tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    if request.param == "chroma":
+        return Chroma(collection_name="shared", embedding_function=embeddings, persist_directory=str(tmp_path / "db"))
+    return QuantizedVectorStore(str(tmp_path / "db"), embeddings)
+
+
+def stored(db):
+    return sorted(doc["source"] for doc in db.get(include=["metadatas"])["metadatas"])
+
+
+def test_sync_only_replaces_sources_in_this_run(db, tmp_path):
+    index = BM25Index(str(tmp_path / "bm25"))
+    sync_documents(db, chunks("a.txt", "apples", "apricots") + chunks("b.txt", "bananas"), indexes=[index])
+    # Another script sharing the collection, with a new version of b.txt only.
+    stats = sync_documents(db, chunks("b.txt", "blueberries"), indexes=[index])
+    assert stats == {"added": 1, "skipped": 0, "deleted": 1}
+    assert stored(db) == ["a.txt", "a.txt", "b.txt"]
+    assert sorted(index.ids()) == sorted(all_ids(db))
+    assert index.search("bananas") == []
+
+
+def test_full_sync_deletes_other_sources(db, tmp_path):
+    index = BM25Index(str(tmp_path / "bm25"))
+    sync_documents(db, chunks("a.txt", "apples") + chunks("b.txt", "bananas"), indexes=[index])
+    stats = sync_documents(db, chunks("b.txt", "bananas"), indexes=[index], full_sync=True)
+    assert stats == {"added": 0, "skipped": 1, "deleted": 1}
+    assert stored(db) == ["b.txt"]
+    assert index.ids() == list(all_ids(db))
+
+
+def test_root_sync_deletes_removed_files(db, tmp_path):
+    index = BM25Index(str(tmp_path / "bm25"))
+    data = str(tmp_path / "data")
+    a, b = f"{data}/a.txt", f"{data}/b.txt"
+    sync_documents(db, chunks(a, "apples") + chunks(b, "bananas") + chunks("other.txt", "oranges"),
+                   indexes=[index], root=data)
+    # b.txt was deleted from the data directory; other.txt belongs to another script.
+    stats = sync_documents(db, chunks(a, "apples"), indexes=[index], root=data)
+    assert stats == {"added": 0, "skipped": 1, "deleted": 1}
+    assert stored(db) == [a, "other.txt"]
+    assert sorted(index.ids()) == sorted(all_ids(db))
+
+
+def test_ingest_files_drops_deleted_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "keep.txt").write_text("Oats are a whole grain.")
+    (tmp_path / "data" / "walocal.txt").write_text("Walnuts are high in fat.")
+    embeddings = DeterministicFakeEmbedding(size=16)
+    ingest_files("data", embeddings)
+    (tmp_path / "data" / "walocal.txt").unlink()
+    db = ingest_files("data", embeddings)
+    assert stored(db) == [os.path.join("data", "keep.txt")]
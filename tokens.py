@@ -0,0 +1,24 @@
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+ENCODING_NAME = "cl100k_base"
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name=ENCODING_NAME):
+    # tiktoken downloads its tables on first use; without network, fall back to an estimate.
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as exc:
+        logging.warning(f"tiktoken encoding {name} unavailable, estimating token counts: {exc}")
+        return None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
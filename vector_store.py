@@ -1,62 +1,230 @@
 import logging
 import os
+from functools import lru_cache
+from itertools import chain, islice
 from typing import List
 
-from langchain_openai import OpenAIEmbeddings
+from filelock import FileLock
 from langchain_chroma import Chroma
-from local_loader import get_document_text
-from remote_loader import download_file
-from splitter import split_documents
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+from local_loader import lazy_load_csv_files, lazy_load_txt_files
+from splitter import chunk_id, iter_split_documents, split_documents
 from dotenv import load_dotenv
-from time import sleep
 
-EMBED_DELAY = 0.02  # 20 milliseconds
+from embedding_cache import CachedEmbeddings
+from embedding_scheduler import EmbeddingScheduler
+from hybrid_retriever import run_in_child_executor
+from metadata_filter import combine_filters
+from model_registry import get_embeddings
+from quantized_index import QuantizedVectorStore
 
+STORE_DIR = "store"
+INGEST_BATCH_SIZE = 256
 
-# This is to get the Streamlit app to use less CPU while embedding documents into Chromadb.
-class EmbeddingProxy:
-    def __init__(self, embedding):
-        self.embedding = embedding
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        sleep(EMBED_DELAY)
-        return self.embedding.embed_documents(texts)
+def store_path(collection_name):
+    return os.path.join(STORE_DIR, collection_name)
 
-    def embed_query(self, text: str) -> List[float]:
-        sleep(EMBED_DELAY)
-        return self.embedding.embed_query(text)
 
+@lru_cache(maxsize=None)
+def collection_lock(collection_name):
+    """Inter-process lock on a collection's store directory, held while it is opened for writing,
+    synced and saved, so that several server workers starting together build it one at a time.
+    Re-entrant within a process."""
+    os.makedirs(STORE_DIR, exist_ok=True)
+    return FileLock(store_path(collection_name) + ".lock")
 
 
-# This happens all at once, not ideal for large datasets.
-def create_vector_db(texts, embeddings=None, collection_name="chroma"):
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def all_ids(db, where=None, page_size=INGEST_BATCH_SIZE * 8):
+    offset = 0
+    while ids := db.get(where=where, include=[], limit=page_size, offset=offset)["ids"]:
+        yield from ids
+        offset += len(ids)
+
+
+def is_under(source, root):
+    return isinstance(source, str) and os.path.abspath(source).startswith(os.path.join(os.path.abspath(root), ""))
+
+
+def stored_sources(db, root, page_size=INGEST_BATCH_SIZE * 8):
+    """The distinct `source` values stored in `db` that are paths under the directory `root`."""
+    sources = set()
+    offset = 0
+    while metadatas := db.get(include=["metadatas"], limit=page_size, offset=offset)["metadatas"]:
+        sources.update(m["source"] for m in metadatas if m and is_under(m.get("source"), root))
+        offset += len(metadatas)
+    return sources
+
+
+def sync_documents(db, texts, batch_size=INGEST_BATCH_SIZE, indexes=(), full_sync=False, root=None):
+    """Make the collection hold `texts` for every source they come from, embedding only chunks
+    it does not already have.
+
+    Stored chunks of a `source` that appears in `texts` but whose content is no longer
+    produced are deleted; chunks of other sources are left alone, since several scripts share
+    the default collection. With a `root` directory, every stored source under it is in scope
+    too, so the chunks of files deleted from it are removed. With `full_sync=True` the
+    collection is made to hold exactly `texts`, deleting everything else.
+
+    `texts` may be any iterable, including a generator; it is consumed one batch at a time.
+    Each of `indexes` (e.g. a BM25Index) is kept in step with the collection through its
+    `add_documents(docs, ids)`, `delete(ids)` and `ids(where)` methods.
+    """
+    seen = set()
+    sources = set()
+    added = 0
+    for n, batch in enumerate(batched(texts, batch_size), start=1):
+        chunks = {}
+        for doc in batch:
+            if doc.metadata.get("source") is not None:
+                sources.add(doc.metadata["source"])
+            cid = chunk_id(doc)
+            if cid not in seen:
+                seen.add(cid)
+                chunks[cid] = doc
+        if not chunks:
+            continue
+        existing = set(db.get(ids=list(chunks), include=[])["ids"])
+        new_ids = [i for i in chunks if i not in existing]
+        if new_ids:
+            db.add_documents([chunks[i] for i in new_ids], ids=new_ids)
+            added += len(new_ids)
+        for index in indexes:
+            missing = [i for i in chunks if i not in index]
+            if missing:
+                index.add_documents([chunks[i] for i in missing], ids=missing)
+        print(f"Batch {n}: {len(seen)} chunks seen, {added} added")
+
+    # Anything stored for these sources that was not produced this run is from an older version
+    # of them. Deleting only after a complete pass means an interrupted run never loses data,
+    # and re-running it skips every batch that was already written.
+    stale_ids = []
+    if not seen:
+        logging.warning("No chunks to index, leaving the collection unchanged")
+    elif full_sync:
+        stale_ids = [i for i in all_ids(db) if i not in seen]
+        for index in indexes:
+            index.delete([i for i in index.ids() if i not in seen])
+    else:
+        if root:
+            sources |= stored_sources(db, root)
+        for group in batched(sorted(sources, key=str), batch_size):
+            where = {"source": {"$in": group}}
+            stale_ids += [i for i in all_ids(db, where) if i not in seen]
+            for index in indexes:
+                index.delete([i for i in index.ids(where) if i not in seen])
+    for batch in batched(stale_ids, batch_size):
+        db.delete(ids=batch)
+
+    return {"added": added, "skipped": len(seen) - added, "deleted": len(stale_ids)}
+
+
+def create_vector_db(texts, embeddings=None, collection_name="chroma", incremental=True,
+                     batch_size=INGEST_BATCH_SIZE, indexes=(), quantization=None, full_sync=False, root=None):
     if not texts:
         logging.warning("Empty texts passed in to create vector database")
     # Select embeddings
     if not embeddings:
         # To use HuggingFace embeddings instead:
-        from langchain_community.embeddings import HuggingFaceEmbeddings
-        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        embeddings = get_embeddings("all-MiniLM-L6-v2")
         # openai_api_key = os.environ["OPENAI_API_KEY"]
         # embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, model="text-embedding-3-small")
 
-    proxy_embeddings = EmbeddingProxy(embeddings)
-    # Create a vectorstore from documents
-    # this will be a chroma collection with a default name.
-    db = Chroma(collection_name=collection_name,
-                embedding_function=proxy_embeddings,
-                persist_directory=os.path.join("store/", collection_name))
-    db.add_documents(texts)
+    # Vectors already computed by any collection are reused from the on-disk cache, and the rest
+    # are batched, rate limited and retried. Pass either wrapper in yourself to tune it.
+    if not isinstance(embeddings, CachedEmbeddings):
+        if not isinstance(embeddings, EmbeddingScheduler):
+            embeddings = EmbeddingScheduler(embeddings)
+        embeddings = CachedEmbeddings(embeddings)
+    # Only one process at a time opens, syncs and saves a collection (see collection_lock).
+    with collection_lock(collection_name):
+        # Create a vectorstore from documents
+        # this will be a chroma collection with a default name.
+        if quantization:
+            # "int8" or "binary": compact codes in memory, full vectors on disk (see quantized_index).
+            db = QuantizedVectorStore(os.path.join(store_path(collection_name), f"quantized_{quantization}"),
+                                      embeddings, mode=quantization)
+        else:
+            db = Chroma(collection_name=collection_name,
+                        embedding_function=embeddings,
+                        persist_directory=store_path(collection_name))
+        if not incremental:
+            for batch in batched(texts, batch_size):
+                db.add_documents(batch)
+                for index in indexes:
+                    index.add_documents(batch, ids=[chunk_id(doc) for doc in batch])
+        elif texts:
+            # Chunks are keyed by content hash, so an unchanged corpus costs no embedding calls on restart.
+            # Only sources in `texts` or under `root` are replaced unless `full_sync` (see sync_documents).
+            stats = sync_documents(db, texts, batch_size, indexes, full_sync, root)
+            print(f"Indexed {collection_name}: {stats['added']} added, "
+                  f"{stats['skipped']} skipped, {stats['deleted']} deleted")
+        if quantization:
+            db.save()
 
     return db
 
 
-def find_similar(vs, query):
-    docs = vs.similarity_search(query)
+# Streams files from data_dir through the splitter into the store, a batch at a time.
+def ingest_files(data_dir="./data", embeddings=None, collection_name="chroma", batch_size=INGEST_BATCH_SIZE):
+    docs = chain(lazy_load_txt_files(data_dir), lazy_load_csv_files(data_dir))
+    # Files removed from data_dir since the last run have their chunks deleted.
+    return create_vector_db(iter_split_documents(docs, workers=os.cpu_count()), embeddings, collection_name,
+                            batch_size=batch_size, root=data_dir)
+
+
+class AsyncEmbeddingRetriever(VectorStoreRetriever):
+    """On the async path, embeds the query with the store's native async embeddings
+    (e.g. a remote endpoint) and only runs the local vector search in a thread.
+
+    A `filter` passed at query time narrows the one in `search_kwargs` rather than replacing it.
+    """
+
+    def _with_filter(self, kwargs):
+        if "filter" in kwargs:
+            kwargs = {**kwargs, "filter": combine_filters(self.search_kwargs.get("filter"), kwargs["filter"])}
+        return kwargs
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs
+    ) -> List[Document]:
+        return super()._get_relevant_documents(query, run_manager=run_manager, **self._with_filter(kwargs))
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, **kwargs
+    ) -> List[Document]:
+        kwargs = self._with_filter(kwargs)
+        if self.search_type != "similarity":
+            return await super()._aget_relevant_documents(query, run_manager=run_manager, **kwargs)
+        vector = await self.vectorstore.embeddings.aembed_query(query)
+        # Under a HybridRetriever the search runs on this child's own threads, not the shared default executor.
+        return await run_in_child_executor(self.vectorstore.similarity_search_by_vector, vector,
+                                           **{**self.search_kwargs, **kwargs})
+
+
+def as_retriever(vs, **kwargs):
+    tags = kwargs.pop("tags", None) or []
+    return AsyncEmbeddingRetriever(vectorstore=vs, tags=tags + vs._get_retriever_tags(), **kwargs)
+
+
+# `filter` restricts the search to chunks whose metadata matches, e.g. {"source": "data/meal_plan.txt"}.
+def find_similar(vs, query, filter=None, k=4):
+    docs = vs.similarity_search(query, k=k, filter=filter)
     return docs
 
 
 def main():
+    from local_loader import get_document_text
+    from remote_loader import download_file
+
     load_dotenv()
 
     pdf_filename = "examples/mal_boole.pdf"
@@ -70,7 +238,7 @@ def main():
     print(f"PDF path is {local_pdf_path}")
 
     with open(local_pdf_path, "rb") as pdf_file:
-        docs = get_document_text(pdf_file, title="Analysis of Logic")
+        docs = get_document_text(pdf_file, title="Analysis of Logic", workers=os.cpu_count())
 
     texts = split_documents(docs)
     vs = create_vector_db(texts)